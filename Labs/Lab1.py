@@ -1,5 +1,5 @@
 import streamlit as st
-from openai import OpenAI
+import llm_gateway
 
 # Show title and description.
 st.title("📄 Document question answering")
@@ -19,7 +19,7 @@ if not openai_api_key:
 else:
 
     # Create an OpenAI client.
-    client = OpenAI(api_key=openai_api_key)
+    client = llm_gateway.openai_client(openai_api_key)
 
     try:
         client.models.list()
@@ -53,6 +53,7 @@ else:
                 model="gpt-5-nano",
                 messages=messages,
                 stream=True,
+                stream_options={"include_usage": True},
             )
 
             # Stream the response to the app using `st.write_stream`.
@@ -1,13 +1,17 @@
 import streamlit as st
-from openai import OpenAI
-import PyPDF2
+import llm_gateway
+import telemetry
 
 # Read PDFs
 def read_pdf(uploaded_file):
-    pdf_reader = PyPDF2.PdfReader(uploaded_file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text()
+    import PyPDF2  # deferred until a PDF is actually uploaded
+
+    with telemetry.span("pdf", "PyPDF2.extract_text") as attrs:
+        pdf_reader = PyPDF2.PdfReader(uploaded_file)
+        text = ""
+        for page in pdf_reader.pages:
+            text += page.extract_text()
+        attrs["pages"] = len(pdf_reader.pages)
     return text
 
 # Show title and description.
@@ -27,7 +31,7 @@ if not openai_api_key:
     st.stop()
 
 # Create an OpenAI client.
-client = OpenAI(api_key=openai_api_key)
+client = llm_gateway.openai_client(openai_api_key)
 
 # Sidebar 
 st.sidebar.header("Summary Options")
@@ -100,6 +104,7 @@ if uploaded_file:
                         model=model,
                         messages=messages,
                         stream=True,
+                        stream_options={"include_usage": True},
                     )
                     
                     st.subheader(f"Summary ({summary_type} in {language}):")
@@ -1,5 +1,5 @@
 import streamlit as st
-from openai import OpenAI
+import llm_gateway
 
 st.title("🤖 Lab 3 - Chatbot with Memory")
 st.write("A friendly chatbot that explains things so a 10-year-old can understand!")
@@ -10,7 +10,7 @@ if not openai_api_key:
     st.error("OpenAI API key not found. Please add OPENAI_API_KEY to your secrets.toml file.")
     st.stop()
 
-client = OpenAI(api_key=openai_api_key)
+client = llm_gateway.openai_client(openai_api_key)
 
 # Configuration
 MAX_BUFFER_MESSAGES = 8  
@@ -84,6 +84,7 @@ if prompt := st.chat_input("Ask me anything!"):
             model=MODEL,
             messages=buffered_messages,
             stream=True,
+            stream_options={"include_usage": True},
         )
         response = st.write_stream(stream)
     
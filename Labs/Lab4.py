@@ -1,13 +1,9 @@
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import uuid
 
 import streamlit as st
-from openai import OpenAI
-import chromadb
-from chromadb.utils import embedding_functions
-import PyPDF2
-import os
+import llm_gateway
+import rag_index
+import telemetry
 
 st.title("📚 Lab 4 - RAG Course Information Chatbot")
 st.write("""
@@ -24,120 +20,74 @@ if not openai_api_key:
     st.stop()
 
 # Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
-
-# Helper function for chunking text
-def chunk_text(text, chunk_size=1000, overlap=200):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += (chunk_size - overlap)
-    return chunks
-
-# Function to create ChromaDB collection
-def create_vector_db():
-    pdf_dir = "./lab4pdfs"
-    
-    # Check if directory exists
-    if not os.path.exists(pdf_dir):
-        st.error(f"Directory {pdf_dir} not found.")
-        return None
-
-    # Retrieve all PDF files
-    pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf')]
-    
-    if not pdf_files:
-        st.error(f"No PDF files found in {pdf_dir}.")
-        return None
-        
-    # Initialize ChromaDB client
-    chroma_client = chromadb.Client()
-    
-    # Create or get collection
-    # We use a new name to force a fresh start if the code changes
-    collection_name = "Lab4Collection_v2" 
-    
-    try:
-        # Try to delete if it exists to ensure freshness (optional, but good for dev)
-        chroma_client.delete_collection(name=collection_name)
-    except:
-        pass
-
-    collection = chroma_client.create_collection(name=collection_name)
-    
-    documents = []
-    metadatas = []
-    ids = []
-
-    id_counter = 0
-    
-    # Process each PDF
-    for filename in pdf_files:
-        file_path = os.path.join(pdf_dir, filename)
-        try:
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                full_text = ""
-                for page in reader.pages:
-                    full_text += page.extract_text()
-                
-                # Chunk the text
-                chunks = chunk_text(full_text, chunk_size=1000, overlap=200)
-                
-                for i, chunk in enumerate(chunks):
-                    documents.append(chunk)
-                    ids.append(f"{filename}_chunk_{i}") # Unique ID per chunk
-                    metadatas.append({"filename": filename, "chunk_id": i})
-                    
-        except Exception as e:
-            st.error(f"Error reading {filename}: {e}")
-
-    # Generate embeddings using batches to avoid API limits
-    embeddings = []
-    batch_size = 100
-    
-    progress_bar = st.progress(0, text="Generating embeddings...")
-    
-    for i in range(0, len(documents), batch_size):
-        batch_docs = documents[i : i + batch_size]
-        try:
-            response = client.embeddings.create(input=batch_docs, model="text-embedding-3-small")
-            batch_embeddings = [data.embedding for data in response.data]
-            embeddings.extend(batch_embeddings)
-            progress_bar.progress((i + len(batch_docs)) / len(documents), text=f"Generated {i + len(batch_docs)}/{len(documents)} embeddings")
-        except Exception as e:
-            st.error(f"Error generating embeddings for batch {i}: {e}")
-            return None # Stop if embedding fails
-            
-    progress_bar.empty()
-
-    collection.add(
-        documents=documents,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        ids=ids
-    )
-    
-    return collection
+client = llm_gateway.openai_client(openai_api_key)
 
 # --- Initialize Vector Database ---
-if "Lab4_VectorDB" not in st.session_state:
+# The index is shared by every session and may already have been built by the
+# background warm-up, in which case this returns immediately.
+if not rag_index.is_ready():
     with st.spinner("Creating vector database from PDF documents..."):
-        st.session_state.Lab4_VectorDB = create_vector_db()
+        progress_bar = st.progress(0, text="Generating embeddings...")
+        vector_db = rag_index.get_index(
+            client,
+            on_progress=lambda fraction, text: progress_bar.progress(fraction, text=text),
+            on_error=st.error,
+        )
+        progress_bar.empty()
+else:
+    vector_db = rag_index.get_index(client)
 
 # Initialize chat history
 if "lab4_messages" not in st.session_state:
     st.session_state.lab4_messages = []
 
+# Documents this session uploads are searched only by this session unless shared
+if "lab4_session" not in st.session_state:
+    st.session_state.lab4_session = uuid.uuid4().hex
+    st.session_state.lab4_uploads = []  # (filename, shared)
+
+# Private uploads are dropped from the index after an hour without a visit
+if not rag_index.touch_scope(st.session_state.lab4_session):
+    st.session_state.lab4_uploads = [u for u in st.session_state.lab4_uploads if u[1]]
+
 # --- Sidebar Info ---
 st.sidebar.header("RAG Info")
-st.sidebar.write(f"**Embedding Model:** text-embedding-3-small")
+st.sidebar.write(f"**Embedding Model:** {rag_index.EMBED_MODEL}")
 st.sidebar.write(f"**LLM Model:** gpt-4o-mini")
 
 st.sidebar.divider()
 
+# --- Add a document ---
+# Only the uploaded file is read and embedded; its chunks are appended to the
+# live index batch by batch while other sessions keep querying it.
+st.sidebar.header("Add a Document")
+if vector_db:
+    uploaded_file = st.sidebar.file_uploader("Upload a PDF", type="pdf")
+    share = st.sidebar.toggle("Share with all users", value=False)
+    if uploaded_file and st.sidebar.button("Add to index"):
+        scope = rag_index.SHARED_SCOPE if share else rag_index.session_scope(st.session_state.lab4_session)
+        upload_progress = st.sidebar.progress(0, text="Reading PDF...")
+        try:
+            status, chunks = rag_index.ingest_pdf(
+                client, vector_db, uploaded_file.getvalue(), uploaded_file.name, scope,
+                on_progress=lambda fraction, text: upload_progress.progress(fraction, text=text),
+            )
+        except Exception as e:
+            st.sidebar.error(f"Error indexing {uploaded_file.name}: {e}")
+        else:
+            if status == "duplicate":
+                st.sidebar.info(f"{uploaded_file.name} is already in the index.")
+            else:
+                st.sidebar.success(f"Added {uploaded_file.name} ({chunks} chunks).")
+                st.session_state.lab4_uploads.append((uploaded_file.name, share))
+        upload_progress.empty()
+    for name, shared in st.session_state.lab4_uploads:
+        st.sidebar.caption(f"{name} ({'shared' if shared else 'private'})")
+else:
+    st.sidebar.info("Uploads are available once the course index is built.")
+
+st.sidebar.divider()
+
 # Clear chat button
 if st.sidebar.button("Clear Chat"):
     st.session_state.lab4_messages = []
@@ -163,15 +113,17 @@ if prompt := st.chat_input("Ask a question about the courses..."):
     context_text = ""
     retrieved_docs = []
 
-    if st.session_state.Lab4_VectorDB:
+    if vector_db:
         with st.spinner("Searching course documents..."):
-            query_response = client.embeddings.create(input=prompt, model="text-embedding-3-small")
+            query_response = client.embeddings.create(input=prompt, model=rag_index.EMBED_MODEL)
             query_embedding = query_response.data[0].embedding
             
-            results = st.session_state.Lab4_VectorDB.query(
-                query_embeddings=[query_embedding],
-                n_results=5
-            )
+            with telemetry.span("retrieval", "chroma.query", n_results=5):
+                results = vector_db.query(
+                    query_embeddings=[query_embedding],
+                    n_results=5,
+                    where=rag_index.visible_to(st.session_state.lab4_session),
+                )
             
             if results['documents']:
                 for i, doc in enumerate(results['documents'][0]):
@@ -200,6 +152,7 @@ Here are the relevant course documents:
             model="gpt-4o-mini",
             messages=messages,
             stream=True,
+            stream_options={"include_usage": True},
         )
         response = st.write_stream(stream)
     
@@ -1,7 +1,6 @@
 import streamlit as st
-import requests
 import json
-from openai import OpenAI
+import llm_gateway
 
 st.set_page_config(page_title="What to Wear Bot", page_icon="🌤️")
 st.title("🌤️ Fashion Bot")
@@ -16,7 +15,7 @@ if not openai_api_key:
     st.stop()
 
 # Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
+client = llm_gateway.openai_client(openai_api_key)
 
 # Get Weather function
 def get_current_weather(location, units="imperial"):
@@ -24,7 +23,7 @@ def get_current_weather(location, units="imperial"):
         f"https://api.openweathermap.org/data/2.5/weather"
         f"?q={location}&appid={weather_api_key}&units={units}"
     )
-    response = requests.get(url)
+    response = llm_gateway.http_get(url)
     if response.status_code == 401:
         raise Exception("Authentication failed: Invalid API key (401 Unauthorized)")
     if response.status_code == 404:
@@ -1,5 +1,9 @@
+import sqlite3
+import threading
+import time
 import streamlit as st
-from openai import OpenAI
+import llm_gateway
+from openai import BadRequestError
 from pydantic import BaseModel
 
 st.title("Lab 6 - Research Agent")
@@ -12,7 +16,16 @@ if not openai_api_key:
     st.error("OpenAI API key not found. Please add OPENAI_API_KEY to your secrets.toml file.")
     st.stop()
 
-client = OpenAI(api_key=openai_api_key)
+client = llm_gateway.openai_client(openai_api_key)
+
+# Streaming render settings: redraw at most STREAM_FPS times a second, or sooner
+# once STREAM_FLUSH_TOKENS deltas are waiting
+STREAM_FPS = 12
+STREAM_FLUSH_TOKENS = 40
+
+# Research cache settings: web results age, so cached answers expire after a TTL
+RESEARCH_DB = "lab6a_research.db"
+RESEARCH_CACHE_TTL = 60 * 60  # seconds
 
 # Pydantic model for structured output (Part D)
 class ResearchSummary(BaseModel):
@@ -20,17 +33,98 @@ class ResearchSummary(BaseModel):
     key_facts: list[str]
     source_hint: str
 
+# Research store: every response is saved with its parent response id, which makes
+# it both a (parent, normalized input, mode) -> response cache and a conversation
+# tree that can be branched from any earlier node.
+def normalize_input(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class ResearchStore:
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                response_id TEXT PRIMARY KEY,
+                parent_id   TEXT NOT NULL,
+                input       TEXT NOT NULL,
+                norm_input  TEXT NOT NULL,
+                mode        TEXT NOT NULL,
+                result      TEXT NOT NULL,
+                created_at  REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_key "
+            "ON responses (parent_id, norm_input, mode, created_at)"
+        )
+        self.conn.commit()
+        with self.lock:
+            self.expire()
+
+    def expire(self):
+        # Deletes expired answers; called with the lock held when the store is
+        # opened and on every write, so the file does not grow without bound
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self.conn.commit()
+
+    def lookup(self, parent_id: str | None, user_input: str, mode: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response_id, result FROM responses "
+                "WHERE parent_id = ? AND norm_input = ? AND mode = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (parent_id or "", normalize_input(user_input), mode, time.time() - self.ttl),
+            ).fetchone()
+        return row
+
+    def save(self, response_id: str, parent_id: str | None, user_input: str, mode: str, result: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (response_id, parent_id or "", user_input, normalize_input(user_input),
+                 mode, result, time.time()),
+            )
+            self.expire()
+
+    def get(self, response_id: str):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT input, mode, result FROM responses WHERE response_id = ?",
+                (response_id,),
+            ).fetchone()
+
+@st.cache_resource
+def get_research_store() -> ResearchStore:
+    return ResearchStore(RESEARCH_DB, RESEARCH_CACHE_TTL)
+
+research_store = get_research_store()
+
+def encode_result(result: str | ResearchSummary) -> str:
+    return result.model_dump_json() if isinstance(result, ResearchSummary) else result
+
+def decode_result(mode: str, raw: str) -> str | ResearchSummary:
+    return ResearchSummary.model_validate_json(raw) if mode == "structured" else raw
+
+def answer_text(result: str | ResearchSummary) -> str:
+    return result.main_answer if isinstance(result, ResearchSummary) else result
+
 # Session state 
 if "last_response_id" not in st.session_state:
     st.session_state.last_response_id = None
 if "first_answer" not in st.session_state:
     st.session_state.first_answer = None
+if "research_turns" not in st.session_state:
+    st.session_state.research_turns = []  # [{"id", "parent_id", "question"}] for branching
 
 # Sidebar
 st.sidebar.header("Settings")
 
 use_streaming   = st.sidebar.toggle("Stream response", value=True)
 use_structured  = st.sidebar.checkbox("Return structured summary")
+use_cache       = st.sidebar.toggle("Reuse recent answers", value=True,
+                                    help=f"Repeated questions within {RESEARCH_CACHE_TTL // 60} minutes are answered from the local cache.")
 
 st.sidebar.divider()
 st.sidebar.header("Agent Info")
@@ -42,6 +136,28 @@ st.sidebar.divider()
 if st.sidebar.button("Reset conversation"):
     st.session_state.last_response_id = None
     st.session_state.first_answer     = None
+    st.session_state.research_turns   = []
+    st.rerun()
+
+# Sidebar: branch from an earlier turn
+st.sidebar.divider()
+st.sidebar.header("Conversation Tree")
+turns = st.session_state.research_turns
+branch_choice = st.sidebar.selectbox(
+    "Earlier turns",
+    [t["id"] for t in reversed(turns)],
+    format_func=lambda rid: next(f"{t['question'][:40]} ({rid[-8:]})" for t in turns if t["id"] == rid),
+    index=None,
+    placeholder="No earlier turns yet" if not turns else "Choose a turn",
+)
+branch_id = st.sidebar.text_input("…or a response id", placeholder="resp_...").strip() or branch_choice
+if st.sidebar.button("Branch from here", disabled=not branch_id):
+    node = research_store.get(branch_id)
+    st.session_state.last_response_id = branch_id
+    st.session_state.first_answer = (
+        answer_text(decode_result(node[1], node[2])) if node else f"(branched from {branch_id})"
+    )
+    st.session_state.followup_input = ""
     st.rerun()
 
 # Helper: display structured output
@@ -52,8 +168,176 @@ def display_structured(parsed: ResearchSummary):
         st.markdown(f"- {fact}")
     st.caption(f"Source hint: {parsed.source_hint}")
 
-# Helper: make a Responses API call
+# Helper: throttled stream renderer
+# Deltas are buffered in a list and only drawn on a frame tick. Finished paragraphs
+# are frozen into their own element, so each redraw only resends the live tail
+# instead of the whole answer so far.
+class StreamRenderer:
+    def __init__(self, fps: float = STREAM_FPS, flush_tokens: int = STREAM_FLUSH_TOKENS):
+        self.container = st.container()
+        self.live = self.container.empty()
+        self.interval = 1.0 / fps
+        self.flush_tokens = flush_tokens
+        self.chunks = []      # every delta, joined once at the end
+        self.tail = []        # deltas not yet frozen into a finished paragraph
+        self.pending = 0
+        self.last_flush = 0.0
+
+    def write(self, delta: str):
+        self.chunks.append(delta)
+        self.tail.append(delta)
+        self.pending += 1
+        if self.pending >= self.flush_tokens or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        tail_text = "".join(self.tail)
+        # Freeze everything up to the last paragraph break, unless that would
+        # split an open code fence
+        cut = tail_text.rfind("\n\n")
+        if cut > 0 and tail_text[:cut].count("```") % 2 == 0:
+            self.live.markdown(tail_text[:cut])
+            self.live = self.container.empty()
+            tail_text = tail_text[cut + 2:]
+            self.tail = [tail_text]
+        self.live.markdown(tail_text if final else tail_text + "▌")
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self) -> str:
+        self.flush(final=True)
+        return "".join(self.chunks)
+
+# Helper: incremental parser for the streamed ResearchSummary JSON
+# Consumes the raw JSON one delta at a time. main_answer characters are passed to
+# the renderer as they decode, each key fact is rendered once its string closes,
+# and source_hint is shown at the end. The full text is validated afterwards.
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class StructuredStreamParser:
+    def __init__(self):
+        self.renderer = StreamRenderer()
+        self.facts_area = st.container()
+        self.raw = []           # every delta, validated once at the end
+        self.depth = 0
+        self.expect_key = False
+        self.key = None         # top-level key whose value is being read
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = None      # partial escape sequence, e.g. "\\u00"
+        self.high_surrogate = None  # first half of a \\uXXXX surrogate pair
+        self.buf = []
+        self.answer_chars = []
+        self.fact_count = 0
+
+    def feed(self, delta: str):
+        self.raw.append(delta)
+        self.answer_chars = []
+        for c in delta:
+            if self.in_string:
+                if self.escape is not None:
+                    self.escape += c
+                    if self.escape[1] != "u":
+                        ch = JSON_ESCAPES.get(c, c)
+                    elif len(self.escape) == 6:
+                        ch = chr(int(self.escape[2:], 16))
+                    else:
+                        continue
+                    self.escape = None
+                elif c == "\\":
+                    self.escape = c
+                    continue
+                elif c == '"':
+                    self.end_string()
+                    continue
+                else:
+                    ch = c
+                ch = self.join_surrogate(ch)
+                if not ch:
+                    continue
+                self.buf.append(ch)
+                if self.key == "main_answer" and not self.string_is_key:
+                    self.answer_chars.append(ch)
+            elif c == '"':
+                self.in_string = True
+                self.string_is_key = self.depth == 1 and self.expect_key
+                self.buf = []
+            elif c == ":" and self.depth == 1:
+                self.expect_key = False
+            elif c == "," and self.depth == 1:
+                self.expect_key = True
+            elif c in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+            elif c in "}]":
+                self.depth -= 1
+        self.write_answer()
+
+    def write_answer(self):
+        if self.answer_chars:
+            self.renderer.write("".join(self.answer_chars))
+            self.answer_chars = []
+
+    def join_surrogate(self, ch: str) -> str:
+        # Characters outside the BMP arrive as two escapes, e.g. "\\ud83d\\ude00".
+        # The high half is held until the low half arrives; unpaired halves become
+        # U+FFFD, since lone surrogates cannot be encoded as UTF-8.
+        high, self.high_surrogate = self.high_surrogate, None
+        if high is not None and "\udc00" <= ch < "\ue000":
+            return chr(0x10000 + (ord(high) - 0xD800) * 0x400 + ord(ch) - 0xDC00)
+        text = "\ufffd" if high is not None else ""
+        if "\ud800" <= ch < "\udc00":
+            self.high_surrogate = ch
+            return text
+        return text + ("\ufffd" if "\udc00" <= ch < "\ue000" else ch)
+
+    def end_string(self):
+        self.in_string = False
+        self.buf.append(self.join_surrogate(""))
+        text = "".join(self.buf)
+        if self.string_is_key:
+            self.key = text
+        elif self.key == "main_answer":
+            self.write_answer()
+            self.renderer.close()
+        elif self.key == "key_facts":
+            if self.fact_count == 0:
+                self.facts_area.markdown("**Key Facts:**")
+            self.facts_area.markdown(f"- {text}")
+            self.fact_count += 1
+        elif self.key == "source_hint":
+            self.facts_area.caption(f"Source hint: {text}")
+
+    def close(self) -> ResearchSummary:
+        return ResearchSummary.model_validate_json("".join(self.raw))
+
+# Helper: make a Responses API call, answering from the research store when possible
 def call_responses_api(user_input: str, previous_id: str | None) -> str | ResearchSummary:
+    mode = "structured" if use_structured else "text"
+
+    cached = research_store.lookup(previous_id, user_input, mode) if use_cache else None
+    if cached:
+        response_id, result = cached[0], decode_result(mode, cached[1])
+        # Streaming modes render inside this function, so do the same for a hit
+        if use_streaming:
+            if isinstance(result, ResearchSummary):
+                display_structured(result)
+            else:
+                st.markdown(result)
+        st.caption("Answered from the research cache.")
+    else:
+        response_id, result = fetch_response(user_input, previous_id)
+        research_store.save(response_id, previous_id, user_input, mode, encode_result(result))
+
+    st.session_state.last_response_id = response_id
+    if all(t["id"] != response_id for t in st.session_state.research_turns):
+        st.session_state.research_turns.append(
+            {"id": response_id, "parent_id": previous_id, "question": user_input}
+        )
+    return result
+
+def fetch_response(user_input: str, previous_id: str | None) -> tuple[str, str | ResearchSummary]:
     common_kwargs = dict(
         model="gpt-4o",
         instructions="You are a helpful research assistant. Always cite your sources.",
@@ -62,35 +346,39 @@ def call_responses_api(user_input: str, previous_id: str | None) -> str | Resear
         previous_response_id=previous_id,
     )
 
-    if use_structured:
+    if use_structured and use_streaming:
+        # Structured output streamed and rendered field by field
+        parser = StructuredStreamParser()
+        with client.responses.stream(**common_kwargs, text_format=ResearchSummary) as stream:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    parser.feed(event.delta)
+        return stream.get_final_response().id, parser.close()
+
+    elif use_structured:
         # Part D: structured output via .parse()
         response = client.responses.parse(
             **common_kwargs,
             text_format=ResearchSummary,
         )
-        st.session_state.last_response_id = response.id
-        return response.output_parsed
+        return response.id, response.output_parsed
 
     elif use_streaming:
-        # Streaming via .create() with stream=True
-        answer_placeholder = st.empty()
-        full_text = ""
+        # Streaming via .stream(), rendered through the throttled renderer
+        renderer = StreamRenderer()
         with client.responses.stream(**common_kwargs) as stream:
             for event in stream:
-                # Accumulate text delta events
-                if hasattr(event, "delta") and hasattr(event.delta, "text"):
-                    full_text += event.delta.text
-                    answer_placeholder.markdown(full_text + "▌")
-        answer_placeholder.markdown(full_text)
+                # Buffer text delta events
+                if event.type == "response.output_text.delta":
+                    renderer.write(event.delta)
+        full_text = renderer.close()
         # Retrieve final response ID from the completed response
-        st.session_state.last_response_id = stream.get_final_response().id
-        return full_text
+        return stream.get_final_response().id, full_text
 
     else:
         # Non-streaming
         response = client.responses.create(**common_kwargs)
-        st.session_state.last_response_id = response.id
-        return response.output_text
+        return response.id, response.output_text
 
 # Part A & C: First question
 st.subheader("Ask a question")
@@ -101,7 +389,8 @@ if user_question and st.session_state.first_answer is None:
         with st.chat_message("assistant"):
             result = call_responses_api(user_question, previous_id=None)
             if use_structured and isinstance(result, ResearchSummary):
-                display_structured(result)
+                if not use_streaming:
+                    display_structured(result)
                 st.session_state.first_answer = result.main_answer
             elif not use_streaming:
                 st.markdown(result)
@@ -126,9 +415,17 @@ if st.session_state.last_response_id:
     if followup:
         with st.spinner("Following up..."):
             with st.chat_message("assistant"):
-                result = call_responses_api(followup, previous_id=st.session_state.last_response_id)
-                if use_structured and isinstance(result, ResearchSummary):
-                    display_structured(result)
-                elif not use_streaming:
-                    st.markdown(result)
-                # streaming already rendered inside call_responses_api
\ No newline at end of file
+                try:
+                    result = call_responses_api(followup, previous_id=st.session_state.last_response_id)
+                except BadRequestError:
+                    # e.g. a branch from a response id that never existed or has expired
+                    st.error(
+                        f"`{st.session_state.last_response_id}` is not a valid response id to continue from. "
+                        "Choose another turn or reset the conversation."
+                    )
+                else:
+                    if use_structured and isinstance(result, ResearchSummary) and not use_streaming:
+                        display_structured(result)
+                    elif not use_streaming:
+                        st.markdown(result)
+                # streaming (plain or structured) already rendered inside call_responses_api
\ No newline at end of file
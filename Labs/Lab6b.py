@@ -1,69 +1,286 @@
+import contextvars
+import itertools
+import queue
+import sqlite3
+import threading
+import time
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import llm_gateway
+import scheduler
+import telemetry
 
 # Page config
 st.set_page_config(page_title="Movie Recommender", layout="wide")
 st.title("Lab 6b - Movie Recommendation Chatbot")
 st.caption("Powered by LangChain & GPT-4o Mini. Select your genre, mood and the persona you have when watching.")
 
-# LLM init (Part A) 
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    api_key=st.secrets["OPENAI_API_KEY"],
-)
+# LLM and chains (Parts A-C), built once per process and shared across reruns
+# and sessions
+@st.cache_resource
+def build_chains():
+    # LangChain is imported here rather than at module level so that loading the
+    # page is cheap; build_chains runs once per process
+    from langchain_core.prompts import PromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
 
-# Part D
-# from langchain_anthropic import ChatAnthropic
-# llm = ChatAnthropic(
-#     model="claude-haiku-4-5-20251001",
-#     api_key=st.secrets["ANTHROPIC_API_KEY"],
-# )
+    # LLM init (Part A)
+    llm = llm_gateway.chat_openai(
+        model="gpt-4o-mini",
+        api_key=st.secrets["OPENAI_API_KEY"],
+    )
+
+    # Part D
+    # from langchain_anthropic import ChatAnthropic
+    # llm = ChatAnthropic(
+    #     model="claude-haiku-4-5-20251001",
+    #     api_key=st.secrets["ANTHROPIC_API_KEY"],
+    # )
+
+    # Chain 1 — Recommendation chain (Part B)
+    rec_template = PromptTemplate(
+        input_variables=["genre", "mood", "persona"],
+        template=(
+            "You are a {persona}. A user is feeling {mood} and wants to watch a {genre} movie. "
+            "Recommend exactly 3 movies that fit both the genre and the mood. "
+            "For each movie, give the title, year, a one-sentence synopsis, and a brief reason "
+            "why it matches the user's current mood. "
+            "Match the tone and writing style of a {persona} throughout your response."
+        ),
+    )
+
+    # Chain 2 — Follow-up chain (Part C)
+    followup_template = PromptTemplate(
+        input_variables=["recommendations", "question"],
+        template=(
+            "Here are some movie recommendations that were just given to a user:\n\n"
+            "{recommendations}\n\n"
+            "The user now has this follow-up question: {question}\n\n"
+            "Answer the question clearly and helpfully using only the context of the "
+            "recommended movies above."
+        ),
+    )
+
+    rec_chain = rec_template | llm | StrOutputParser()
+    followup_chain = followup_template | llm | StrOutputParser()
+    return rec_chain, followup_chain
+
+rec_chain, followup_chain = build_chains()
+
+# Sidebar options
+GENRES = ["Action", "Comedy", "Horror", "Drama", "Sci-Fi", "Thriller", "Romance"]
+MOODS = ["Excited", "Happy", "Sad", "Bored", "Scared", "Romantic", "Curious", "Tense", "Melancholy"]
+PERSONAS = ["Film Critic", "Casual Friend", "Movie Journalist"]
+
+# Recommendation cache settings
+REC_DB = "lab6b_recommendations.db"
+REC_CACHE_TTL = 24 * 60 * 60  # seconds
+WARMUP_BATCH_SIZE = 9         # combinations sent per rec_chain.batch call
+WARMUP_MAX_CONCURRENCY = 3    # parallel model calls inside each batch
+COMPARE_REDRAW_SECONDS = 0.1  # minimum gap between redraws of a comparison column
 
 #  Session state 
 if "last_recommendation" not in st.session_state:
     st.session_state.last_recommendation = ""
+if "last_comparison" not in st.session_state:
+    st.session_state.last_comparison = {}
+
+# Recommendation cache: the sidebar is a closed set of genre x mood x persona
+# combinations, so each one is generated once and reused until it expires.
+class RecommendationCache:
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS recommendations (
+                genre      TEXT NOT NULL,
+                mood       TEXT NOT NULL,
+                persona    TEXT NOT NULL,
+                result     TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (genre, mood, persona)
+            )"""
+        )
+        self.conn.commit()
+        self.warmup_thread = None
+
+    def get(self, genre: str, mood: str, persona: str) -> str | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result FROM recommendations "
+                "WHERE genre = ? AND mood = ? AND persona = ? AND created_at >= ?",
+                (genre, mood, persona, time.time() - REC_CACHE_TTL),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, genre: str, mood: str, persona: str, result: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?)",
+                (genre, mood, persona, result, time.time()),
+            )
+            self.conn.commit()
+
+    def missing(self) -> list[dict]:
+        return [
+            {"genre": g, "mood": m, "persona": p}
+            for g, m, p in itertools.product(GENRES, MOODS, PERSONAS)
+            if self.get(g, m, p) is None
+        ]
+
+    def fresh_count(self) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM recommendations WHERE created_at >= ?",
+                (time.time() - REC_CACHE_TTL,),
+            ).fetchone()[0]
+
+    def warming(self) -> bool:
+        return self.warmup_thread is not None and self.warmup_thread.is_alive()
+
+    def start_warmup(self, chain):
+        if self.warming():
+            return
+        # The warm-up is charged to, and queues as, the session that started it;
+        # chain.batch copies this context into its own workers
+        with telemetry.carry(), scheduler.session(scheduler.current_session()):
+            context = contextvars.copy_context()
+        self.warmup_thread = threading.Thread(target=context.run, args=(self.warmup, chain), daemon=True)
+        self.warmup_thread.start()
+
+    def warmup(self, chain):
+        # Pre-generate every missing combination through rec_chain.batch, a few at a time
+        todo = self.missing()
+        for i in range(0, len(todo), WARMUP_BATCH_SIZE):
+            batch = todo[i : i + WARMUP_BATCH_SIZE]
+            results = chain.batch(
+                batch,
+                config={"max_concurrency": WARMUP_MAX_CONCURRENCY},
+                return_exceptions=True,
+            )
+            for inputs, result in zip(batch, results):
+                if isinstance(result, str):
+                    self.put(inputs["genre"], inputs["mood"], inputs["persona"], result)
+
+@st.cache_resource
+def get_recommendation_cache() -> RecommendationCache:
+    return RecommendationCache(REC_DB)
+
+rec_cache = get_recommendation_cache()
 
 # Sidebar controls (Part B) 
 st.sidebar.header("Customize Your Picks")
 
-genre = st.sidebar.selectbox(
-    "Genre",
-    ["Action", "Comedy", "Horror", "Drama", "Sci-Fi", "Thriller", "Romance"],
-)
-
-mood = st.sidebar.selectbox(
-    "Mood",
-    ["Excited", "Happy", "Sad", "Bored", "Scared", "Romantic", "Curious", "Tense", "Melancholy"],
-)
-
-persona = st.sidebar.selectbox(
-    "Recommender Persona",
-    ["Film Critic", "Casual Friend", "Movie Journalist"],
-)
-
-# Chain 1 — Recommendation chain (Part B) 
-rec_template = PromptTemplate(
-    input_variables=["genre", "mood", "persona"],
-    template=(
-        "You are a {persona}. A user is feeling {mood} and wants to watch a {genre} movie. "
-        "Recommend exactly 3 movies that fit both the genre and the mood. "
-        "For each movie, give the title, year, a one-sentence synopsis, and a brief reason "
-        "why it matches the user's current mood. "
-        "Match the tone and writing style of a {persona} throughout your response."
-    ),
-)
-
-rec_chain = rec_template | llm | StrOutputParser()
+genre = st.sidebar.selectbox("Genre", GENRES)
+
+mood = st.sidebar.selectbox("Mood", MOODS)
+
+persona = st.sidebar.selectbox("Recommender Persona", PERSONAS)
+
+compare_mode = st.sidebar.toggle("Compare personas side by side")
+compare_personas = []
+if compare_mode:
+    compare_personas = st.sidebar.multiselect("Personas to compare", PERSONAS, default=PERSONAS)
+
+# Comparison mode: every persona streams into its own column at the same time, so
+# the wait is roughly the slowest single call rather than the sum of all of them.
+# Each persona is read with the sync stream() in its own thread, and the script
+# thread draws the chunks they hand over. (An event loop per click would leave the
+# shared async client holding connections bound to a loop that has been closed.)
+def stream_persona(persona: str, events: queue.Queue):
+    try:
+        for chunk in rec_chain.stream({"genre": genre, "mood": mood, "persona": persona}):
+            events.put((persona, chunk))
+    except Exception as e:
+        events.put((persona, e))
+    events.put((persona, None))
+
+def stream_comparison(personas: list[str], columns) -> list[str]:
+    placeholders, chunks, last_draw = {}, {}, {}
+    events = queue.Queue()
+    streaming = set()
+    for persona, column in zip(personas, columns):
+        column.markdown(f"**{persona}**")
+        placeholders[persona] = column.empty()
+        cached = rec_cache.get(genre, mood, persona)
+        if cached is not None:
+            placeholders[persona].markdown(cached)
+            chunks[persona] = [cached]
+            continue
+        chunks[persona], last_draw[persona] = [], 0.0
+        streaming.add(persona)
+        # The script context keeps these calls interactive and attributed to this session
+        worker = threading.Thread(target=stream_persona, args=(persona, events), daemon=True)
+        add_script_run_ctx(worker, get_script_run_ctx())
+        worker.start()
+
+    errors = {}
+    while streaming:
+        persona, chunk = events.get()
+        if chunk is None:
+            streaming.discard(persona)
+            result = "".join(chunks[persona])
+            placeholders[persona].markdown(result)
+            if persona not in errors:
+                rec_cache.put(genre, mood, persona, result)
+        elif isinstance(chunk, Exception):
+            errors[persona] = chunk
+        else:
+            chunks[persona].append(chunk)
+            if time.monotonic() - last_draw[persona] >= COMPARE_REDRAW_SECONDS:
+                placeholders[persona].markdown("".join(chunks[persona]) + "▌")
+                last_draw[persona] = time.monotonic()
+    if errors:
+        raise next(iter(errors.values()))
+    return ["".join(chunks[persona]) for persona in personas]
+
+def show_comparison(comparison: dict):
+    for column, (name, text) in zip(st.columns(len(comparison)), comparison.items()):
+        column.markdown(f"**{name}**")
+        column.markdown(text)
+
+# Sidebar: cache status and background warm-up
+st.sidebar.divider()
+total_combos = len(GENRES) * len(MOODS) * len(PERSONAS)
+st.sidebar.write(f"**Cached picks:** {rec_cache.fresh_count()}/{total_combos}")
+if rec_cache.warming():
+    st.sidebar.caption("Warm-up running in the background…")
+elif st.sidebar.button("Warm up all combinations"):
+    rec_cache.start_warmup(rec_chain)
+    st.rerun()
 
 # Recommendation button 
-if st.button(" Get Recommendations", type="primary"):
-    with st.spinner("Finding the perfect movies for you…"):
-        result = rec_chain.invoke({"genre": genre, "mood": mood, "persona": persona})
-        st.session_state.last_recommendation = result
+get_recs = st.button(" Get Recommendations", type="primary")
+
+if get_recs and compare_mode:
+    if not compare_personas:
+        st.warning("Please choose at least one persona to compare.")
+    else:
+        st.subheader("Your Recommendations")
+        results = stream_comparison(compare_personas, st.columns(len(compare_personas)))
+        st.session_state.last_comparison = dict(zip(compare_personas, results))
+        # The follow-up chain sees every persona's picks
+        st.session_state.last_recommendation = "\n\n".join(
+            f"{name}:\n{text}" for name, text in st.session_state.last_comparison.items()
+        )
 
-if st.session_state.last_recommendation:
+elif get_recs:
+    st.subheader("Your Recommendations")
+    result = rec_cache.get(genre, mood, persona)
+    if result is None:
+        # Stream tokens as they arrive instead of waiting for the full answer
+        result = st.write_stream(rec_chain.stream({"genre": genre, "mood": mood, "persona": persona}))
+        rec_cache.put(genre, mood, persona, result)
+    else:
+        st.markdown(result)
+    st.session_state.last_recommendation = result
+    st.session_state.last_comparison = {}
+
+elif st.session_state.last_comparison:
+    st.subheader("Your Recommendations")
+    show_comparison(st.session_state.last_comparison)
+
+elif st.session_state.last_recommendation:
     st.subheader("Your Recommendations")
     st.markdown(st.session_state.last_recommendation)
 
@@ -71,29 +288,16 @@ if st.session_state.last_recommendation:
 st.divider()
 follow_up = st.text_input("Ask a follow-up question about these movies:")
 
-followup_template = PromptTemplate(
-    input_variables=["recommendations", "question"],
-    template=(
-        "Here are some movie recommendations that were just given to a user:\n\n"
-        "{recommendations}\n\n"
-        "The user now has this follow-up question: {question}\n\n"
-        "Answer the question clearly and helpfully using only the context of the "
-        "recommended movies above."
-    ),
-)
-
-followup_chain = followup_template | llm | StrOutputParser()
-
 if follow_up:
     if not st.session_state.last_recommendation:
         st.warning("Please get recommendations first before asking a follow-up question.")
     else:
-        with st.spinner("Thinking…"):
-            followup_result = followup_chain.invoke(
+        st.subheader("💬 Follow-Up Answer")
+        st.write_stream(
+            followup_chain.stream(
                 {
                     "recommendations": st.session_state.last_recommendation,
                     "question": follow_up,
                 }
             )
-        st.subheader("💬 Follow-Up Answer")
-        st.markdown(followup_result)
\ No newline at end of file
+        )
\ No newline at end of file
@@ -1,13 +1,38 @@
 import streamlit as st
-from openai import OpenAI
-import requests
+import llm_gateway
+import scheduler
+import telemetry
 import base64
+import contextvars
+import csv
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import socket
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # Page config 
 st.set_page_config(page_title="Lab 8 – Image Captioning Bot", page_icon="🖼️")
 
 # OpenAI client 
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+client = llm_gateway.openai_client(st.secrets["OPENAI_API_KEY"])
+
+# Captioning settings
+CAPTION_MODEL = "gpt-4.1-mini"
+CAPTION_CACHE_MAX_ENTRIES = 256
+URL_FETCH_TIMEOUT = 15  # seconds
+URL_FETCH_MAX_BYTES = 20 * 1024 * 1024
+URL_FETCH_MAX_REDIRECTS = 5
+
+# Batch captioning settings
+BATCH_DEFAULT_CONCURRENCY = 4
+BATCH_MAX_CONCURRENCY = 16
+PREPROCESS_WORKERS = os.cpu_count() or 4
 
 # Session state
 if "url_response" not in st.session_state:
@@ -16,6 +41,9 @@ if "url_response" not in st.session_state:
 if "upload_response" not in st.session_state:
     st.session_state.upload_response = None
 
+if "batch_results" not in st.session_state:
+    st.session_state.batch_results = []
+
 # Shared prompt
 PROMPT = (
     "Describe the image in at least 3 sentences. "
@@ -24,6 +52,222 @@ PROMPT = (
     "Captions should vary in tone, such as, but not limited to funny, intellectual, and aesthetic."
 )
 
+# Image preprocessing
+# Longest edge the model actually looks at for each detail level: "low" sees a
+# 512px image; "high"/"auto" fit within 2048px and then scale the short side to 768px.
+LOW_DETAIL_MAX_EDGE = 512
+HIGH_DETAIL_MAX_EDGE = 2048
+HIGH_DETAIL_SHORT_EDGE = 768
+JPEG_QUALITY = 85
+
+
+def target_size(width, height, detail):
+    if detail == "low":
+        scale = LOW_DETAIL_MAX_EDGE / max(width, height)
+    else:
+        scale = min(HIGH_DETAIL_MAX_EDGE / max(width, height), HIGH_DETAIL_SHORT_EDGE / min(width, height))
+    scale = min(scale, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+# Raised for an upload or download that is not an image the page can use
+class ImageError(ValueError):
+    pass
+
+
+def prepare_image(file, detail):
+    # Decode straight from the file object, downscale to what the detail level uses,
+    # and re-encode without metadata. Returns (mime type, base64 string).
+    from PIL import Image, ImageOps  # deferred until the first image is captioned
+
+    try:
+        img = Image.open(file)
+        size = target_size(*img.size, detail)
+        img.draft("RGB", size)  # JPEGs decode at reduced scale instead of full size
+        img = ImageOps.exif_transpose(img)  # apply EXIF rotation before it is dropped
+        img.thumbnail(target_size(*img.size, detail), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            img.save(buffer, format="WEBP", quality=JPEG_QUALITY)
+            mime = "image/webp"
+        else:
+            img.convert("RGB").save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            mime = "image/jpeg"
+    except Image.DecompressionBombError as e:
+        raise ImageError("The image has too many pixels to process.") from e
+    except (OSError, SyntaxError, ValueError) as e:  # PIL reports corrupt files with all three
+        raise ImageError("The file could not be read as an image.") from e
+    return mime, base64.b64encode(buffer.getbuffer()).decode("ascii")
+
+
+# Caption cache
+# Keyed by a hash of the normalized image bytes plus prompt, model and detail, so
+# the same picture hits the cache whether it came from an upload or any URL.
+# Least recently used entries are evicted once the cache is full.
+class CaptionCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, caption):
+        with self.lock:
+            self.entries[key] = caption
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_caption_cache():
+    return CaptionCache(CAPTION_CACHE_MAX_ENTRIES)
+
+
+caption_cache = get_caption_cache()
+
+
+def caption_key(b64, detail):
+    digest = hashlib.sha256(b64.encode("ascii")).hexdigest()
+    settings = hashlib.sha256(f"{PROMPT}\0{CAPTION_MODEL}\0{detail}".encode("utf-8")).hexdigest()
+    return f"{digest}:{settings}"
+
+
+def generate_caption(mime, b64, detail):
+    key = caption_key(b64, detail)
+    caption = caption_cache.get(key)
+    if caption is not None:
+        return caption
+
+    response = client.chat.completions.create(
+        model=CAPTION_MODEL,
+        max_tokens=1024,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime};base64,{b64}", "detail": detail},
+                    },
+                    {"type": "text", "text": PROMPT},
+                ],
+            }
+        ],
+    )
+    caption = response.choices[0].message.content
+    caption_cache.put(key, caption)
+    return caption
+
+
+def check_url(url):
+    # The server makes the download, so a link may only reach a public http(s)
+    # address; the mock APIs at LLM_GATEWAY_UPSTREAM are allowed for load tests
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError as e:
+        raise ImageError("That is not a valid URL.") from e
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ImageError("Please enter an http:// or https:// link to an image.")
+    if llm_gateway.UPSTREAM and parts.netloc == urllib.parse.urlsplit(llm_gateway.UPSTREAM).netloc:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ImageError(f"Could not find the host {parts.hostname}.") from e
+    if not all(ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses):
+        raise ImageError("That link does not point to a public address.")
+
+
+def read_image(response, buffer):
+    # Reads an image response into buffer, stopping at URL_FETCH_MAX_BYTES
+    response.raise_for_status()
+    if not response.headers.get("content-type", "").startswith("image/"):
+        raise ImageError("That link did not return an image. Please use a direct image URL.")
+    too_large = ImageError(f"The image is larger than {URL_FETCH_MAX_BYTES // (1024 * 1024)} MB.")
+    if int(response.headers.get("content-length") or 0) > URL_FETCH_MAX_BYTES:
+        raise too_large
+    for chunk in response.iter_bytes():
+        buffer.write(chunk)
+        if buffer.tell() > URL_FETCH_MAX_BYTES:
+            raise too_large
+
+
+def fetch_image(url):
+    # Streams the download. These are arbitrary user URLs, so the gateway is told
+    # not to cache them, and redirects are followed here so that every hop goes
+    # through check_url.
+    buffer = io.BytesIO()
+    for _ in range(URL_FETCH_MAX_REDIRECTS + 1):
+        check_url(url)
+        try:
+            with llm_gateway.http_stream(url, timeout=URL_FETCH_TIMEOUT, follow_redirects=False,
+                                         extensions={"gateway_cache": False}) as response:
+                if not response.is_redirect:
+                    read_image(response, buffer)
+                    buffer.seek(0)
+                    return buffer
+                url = urllib.parse.urljoin(url, response.headers["location"])
+        except llm_gateway.InvalidURL as e:
+            raise ImageError("That is not a valid URL.") from e
+    raise ImageError("That link redirects too many times.")
+
+
+# Batch helpers
+# Images are loaded and preprocessed in one worker pool, then captioned in a
+# second pool whose size is the concurrency limit. Rate-limited and failed calls
+# are retried by the gateway, which pauses the provider for every caller on a 429.
+# Only the main thread touches Streamlit elements; workers run in a copy of its
+# context so their calls are charged to this page and queue as this session.
+def load_batch_item(source, detail):
+    file = fetch_image(source) if isinstance(source, str) else source
+    return prepare_image(file, detail)
+
+
+def run_batch(items, concurrency, on_update):
+    # items: list of (name, source, detail) where source is a URL or an uploaded file
+    results = [{"name": name, "status": "queued", "caption": ""} for name, _, _ in items]
+    with telemetry.carry(), scheduler.session(scheduler.current_session()):
+        context = contextvars.copy_context()
+    with ThreadPoolExecutor(PREPROCESS_WORKERS) as prep_pool, ThreadPoolExecutor(concurrency) as caption_pool:
+        pending = {
+            prep_pool.submit(context.copy().run, load_batch_item, source, detail): (i, "prepare")
+            for i, (_, source, detail) in enumerate(items)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, stage = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    results[i].update(status="error", caption=str(e))
+                    continue
+                if stage == "prepare":
+                    pending[caption_pool.submit(context.copy().run, generate_caption, *value, items[i][2])] = (i, "caption")
+                    results[i]["status"] = "captioning"
+                else:
+                    results[i].update(status="done", caption=value)
+            on_update(results)
+    return results
+
+
+def results_to_csv(results):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=["name", "status", "caption"])
+    writer.writeheader()
+    writer.writerows(results)
+    return buffer.getvalue()
+
 
 # Header
 st.title("Image Captioning Bot")
@@ -48,29 +292,21 @@ st.caption("⚠️ Ensure the link leads directly to the image and not a webpage
 if st.button("Generate Caption for Inputted URL"):
     if url:
         with st.spinner("Generating captions from URL…"):
-            url_response = client.chat.completions.create(
-                model="gpt-4.1-mini",
-                max_tokens=1024,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": url, "detail": "auto"},
-                            },
-                            {"type": "text", "text": PROMPT},
-                        ],
-                    }
-                ],
-            )
-            st.session_state.url_response = url_response
+            # Fetch and normalize the image locally so the cache can key on its content
+            try:
+                mime, b64 = prepare_image(fetch_image(url), "auto")
+            except llm_gateway.HTTPError as e:
+                st.error(f"Could not download the image: {e}")
+            except ImageError as e:
+                st.error(str(e))
+            else:
+                st.session_state.url_response = generate_caption(mime, b64, "auto")
     else:
         st.warning("Please enter an image URL first.")
 
 if st.session_state.url_response:
     st.image(url, use_container_width=True)
-    st.write(st.session_state.url_response.choices[0].message.content)
+    st.write(st.session_state.url_response)
 
 st.divider()
 
@@ -87,28 +323,14 @@ uploaded = st.file_uploader(
 if st.button("Generate Caption for Uploaded Image"):
     if uploaded:
         with st.spinner("Generating captions from uploaded image…"):
-            # Encode image to base64
-            b64 = base64.b64encode(uploaded.read()).decode("utf-8")
-            mime = uploaded.type   # e.g. "image/png"
-            data_uri = f"data:{mime};base64,{b64}"
-
-            upload_response = client.chat.completions.create(
-                model="gpt-4.1-mini",
-                max_tokens=1024,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": data_uri, "detail": "low"},
-                            },
-                            {"type": "text", "text": PROMPT},
-                        ],
-                    }
-                ],
-            )
-            st.session_state.upload_response = upload_response
+            # Downscale, re-encode and base64 the image
+            uploaded.seek(0)
+            try:
+                mime, b64 = prepare_image(uploaded, "low")
+            except ImageError as e:
+                st.error(str(e))
+            else:
+                st.session_state.upload_response = generate_caption(mime, b64, "low")
     else:
         st.warning("Please upload an image first.")
 
@@ -116,4 +338,56 @@ if st.session_state.upload_response:
     # Reset file pointer so st.image can read it
     uploaded.seek(0)
     st.image(uploaded, use_container_width=True)
-    st.write(st.session_state.upload_response.choices[0].message.content)
\ No newline at end of file
+    st.write(st.session_state.upload_response)
+
+st.divider()
+
+# Part C – Batch Captioning
+
+st.header("Batch Captioning")
+st.write("Caption a whole folder at once: upload several images and/or paste one image URL per line.")
+
+batch_files = st.file_uploader(
+    "Upload images",
+    type=["jpg", "jpeg", "png", "webp", "gif"],
+    accept_multiple_files=True,
+    key="batch_files",
+)
+batch_urls = st.text_area("Image URLs (one per line)", key="batch_urls")
+batch_concurrency = st.slider(
+    "Concurrent requests",
+    min_value=1,
+    max_value=BATCH_MAX_CONCURRENCY,
+    value=BATCH_DEFAULT_CONCURRENCY,
+)
+
+if st.button("Generate Captions for Batch"):
+    # Uploads get "low" detail like Part B; URLs keep "auto" like Part A
+    items = [(f.name, f, "low") for f in batch_files or []]
+    items += [(u, u, "auto") for u in (line.strip() for line in batch_urls.splitlines()) if u]
+    if items:
+        progress = st.progress(0.0, text=f"Captioning 0/{len(items)} images…")
+        status_table = st.empty()
+
+        def show_progress(results):
+            finished = sum(r["status"] in ("done", "error") for r in results)
+            progress.progress(finished / len(results), text=f"Captioning {finished}/{len(results)} images…")
+            status_table.dataframe(
+                [{"name": r["name"], "status": r["status"]} for r in results],
+                use_container_width=True,
+            )
+
+        st.session_state.batch_results = run_batch(items, batch_concurrency, show_progress)
+        progress.empty()
+        status_table.empty()
+    else:
+        st.warning("Please upload images or enter image URLs first.")
+
+if st.session_state.batch_results:
+    results = st.session_state.batch_results
+    failed = sum(r["status"] == "error" for r in results)
+    st.write(f"**{len(results) - failed} captioned, {failed} failed.**")
+    st.dataframe(results, use_container_width=True)
+    col1, col2 = st.columns(2)
+    col1.download_button("Download CSV", results_to_csv(results), "captions.csv", "text/csv")
+    col2.download_button("Download JSON", json.dumps(results, indent=2), "captions.json", "application/json")
@@ -1,47 +1,360 @@
 import streamlit as st
 import json
 import os
-from anthropic import Anthropic
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+import llm_gateway
 
 # Page config
 st.title("🧠 Chatbot with Long-Term Memory")
-st.caption("Memories persist across sessions via memories.json")
+st.caption("Memories persist across sessions in a local SQLite store")
 
 # Constants
-MEMORY_FILE = "memories.json"
+MEMORY_DB = "memories.db"
+LEGACY_MEMORY_FILE = "memories.json"  # imported into the default profile once
+DEFAULT_USER = "default"
 CHAT_MODEL = "claude-opus-4-5"
 EXTRACT_MODEL = "claude-haiku-4-5-20251001"
+EMBED_MODEL = "text-embedding-3-small"
+LOCAL_EMBED_MODEL = "local-hash-512"
+LOCAL_EMBED_DIM = 512
+MEMORY_TOP_K = 8            # most memories injected into one prompt
+MEMORY_TOKEN_BUDGET = 300   # estimated tokens available to the memory block
+EXTRACT_BATCH_SIZE = 4      # most exchanges folded into one extraction call
+EXTRACT_BATCH_WAIT = 3.0    # seconds to wait for more exchanges before extracting
+HISTORY_TOKEN_BUDGET = 3000 # estimated tokens of recent chat history sent each turn
+SUMMARY_BATCH_MESSAGES = 6  # dropped messages to collect before re-summarising
+COMPACTION_INTERVAL = 15 * 60  # seconds between full compaction sweeps per user
+# Cosine similarity at which a new memory and a stored one are sent to
+# EXTRACT_MODEL to be merged on write, and at which memories are grouped for
+# merging in a full sweep. The local hashed vectors score lower than OpenAI
+# embeddings for the same paraphrase.
+SUPERSEDE_SIMILARITY = {"text-embedding-3-small": 0.90, "local-hash-512": 0.85}
+CLUSTER_SIMILARITY = {"text-embedding-3-small": 0.75, "local-hash-512": 0.60}
 
-# API client
-client = Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
+# API clients
+# Created on first use, so the page renders before the SDKs are imported;
+# llm_gateway keeps one client per key for the whole process. numpy and openai
+# are likewise imported by the functions that use them.
+ANTHROPIC_API_KEY = st.secrets["ANTHROPIC_API_KEY"]
+OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY")
+EMBEDDER = EMBED_MODEL if OPENAI_API_KEY else LOCAL_EMBED_MODEL
+
+def chat_client():
+    return llm_gateway.anthropic_client(ANTHROPIC_API_KEY)
+
+def embed_client():
+    return llm_gateway.openai_client(OPENAI_API_KEY)
 
 # Session state 
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "memories_seen_at" not in st.session_state:
+    st.session_state.memories_seen_at = time.time()
+if "memory_toasts" not in st.session_state:
+    st.session_state.memory_toasts = []
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = ""
+    st.session_state.summary_upto = 0  # messages[:summary_upto] are in the summary
+    st.session_state.summary_key = uuid.uuid4().hex  # names this chat's summary jobs
+
+# Embeddings
+# OpenAI embeddings when a key is configured, otherwise a local hashed
+# bag-of-words vector so retrieval still works offline. Vectors are unit length,
+# so a dot product is the cosine similarity.
+def vector_to_blob(vector):
+    import numpy as np
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def local_embed(text):
+    import numpy as np
+    vector = np.zeros(LOCAL_EMBED_DIM, dtype=np.float32)
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        h = zlib.crc32(token.encode("utf-8"))
+        vector[h % LOCAL_EMBED_DIM] += 1.0 if h & 1 << 31 else -1.0
+    return vector
+
+def embed_texts(texts):
+    import numpy as np
+    if OPENAI_API_KEY:
+        response = embed_client().embeddings.create(input=texts, model=EMBED_MODEL)
+        vectors = np.array([d.embedding for d in response.data], dtype=np.float32)
+    else:
+        vectors = np.array([local_embed(t) for t in texts], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def estimate_tokens(text):
+    # Estimate: 1 token ≈ 4 characters
+    return len(text) // 4 + 1
+
+# Memory store
+# SQLite in WAL mode: appends are single-row transactions, readers never block the
+# writer, and UNIQUE(user_id, fact) makes repeated writes harmless. Each memory is
+# embedded once when written and the vector is stored next to it. Reads are served
+# from an in-process cache that is dropped whenever that user's memories change.
+class MemoryStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.merge_locks = {}  # user_id -> lock held while that user's memories are merged
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS memories (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id     TEXT NOT NULL,
+                fact        TEXT NOT NULL,
+                created_at  REAL NOT NULL,
+                embedding   BLOB,
+                embed_model TEXT,
+                UNIQUE (user_id, fact)
+            )"""
+        )
+        # Stores created before vectors were added
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+        for column, kind in (("embedding", "BLOB"), ("embed_model", "TEXT")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE memories ADD COLUMN {column} {kind}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_user ON memories (user_id, id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def rows(self, user_id):
+        # Cached (ids, facts, embeddings, embed_models) for one user, oldest first
+        with self.lock:
+            if user_id not in self.cache:
+                rows = self.conn.execute(
+                    "SELECT id, fact, embedding, embed_model FROM memories WHERE user_id = ? ORDER BY id",
+                    (user_id,),
+                ).fetchall()
+                self.cache[user_id] = tuple(list(col) for col in zip(*rows)) if rows else ([], [], [], [])
+            return self.cache[user_id]
+
+    def load(self, user_id):
+        return list(self.rows(user_id)[1])
+
+    def add(self, user_id, facts, embeddings=None, embed_model=None, remove_ids=()):
+        # Returns only the facts that were actually new. remove_ids are deleted in the
+        # same transaction, for memories the new facts supersede.
+        added = []
+        now = time.time()
+        blobs = [vector_to_blob(v) for v in embeddings] if embeddings is not None else [None] * len(facts)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM memories WHERE user_id = ? AND id = ?", [(user_id, i) for i in remove_ids]
+            )
+            for fact, blob in zip(facts, blobs):
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO memories (user_id, fact, created_at, embedding, embed_model) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (user_id, fact, now, blob, embed_model if blob else None),
+                )
+                if cur.rowcount:
+                    added.append(fact)
+            if added or remove_ids:
+                self.cache.pop(user_id, None)
+        return added
+
+    def set_embeddings(self, user_id, ids, embeddings, embed_model):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE memories SET embedding = ?, embed_model = ? WHERE id = ?",
+                [(vector_to_blob(v), embed_model, i) for i, v in zip(ids, embeddings)],
+            )
+            self.cache.pop(user_id, None)
+
+    def clear(self, user_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM memories WHERE user_id = ?", (user_id,))
+            self.cache.pop(user_id, None)
+
+    def ever_written(self):
+        # AUTOINCREMENT keeps the highest id ever used, even after the rows are deleted
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'memories'").fetchone() is not None
+
+    def claim(self, key):
+        # Records key in the meta table; True only for the first caller ever
+        with self.lock, self.conn:
+            cur = self.conn.execute("INSERT OR IGNORE INTO meta VALUES (?, ?)", (key, str(time.time())))
+            return cur.rowcount == 1
+
+    def merge_lock(self, user_id):
+        # Merges read a snapshot and then replace rows from it, so two of them
+        # (the sidebar button and the worker's sweep) must not overlap
+        with self.lock:
+            return self.merge_locks.setdefault(user_id, threading.Lock())
+
+@st.cache_resource
+def get_memory_store():
+    store = MemoryStore(MEMORY_DB)
+    # The legacy file is considered once per database, and only if no memory was
+    # ever stored in it, so memories cleared afterwards are not imported again
+    if os.path.exists(LEGACY_MEMORY_FILE) and store.claim("legacy_import"):
+        if not store.ever_written():
+            with open(LEGACY_MEMORY_FILE, "r") as f:
+                store.add(DEFAULT_USER, [str(m) for m in json.load(f)])
+    return store
+
+memory_store = get_memory_store()
 
 # Memory functions
 
-def load_memories():
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r") as f:
-            return json.load(f)
-    return []
+def load_memories(user_id):
+    return memory_store.load(user_id)
 
-def save_memories(memories):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(memories, f, indent=2)
+def memory_vectors(user_id):
+    # (ids, facts, matrix) with every memory embedded by the active embedder;
+    # rows written while embeddings were unavailable are backfilled here
+    import numpy as np
+    ids, facts, blobs, models = memory_store.rows(user_id)
+    stale = [i for i, (b, m) in enumerate(zip(blobs, models)) if b is None or m != EMBEDDER]
+    if stale:
+        memory_store.set_embeddings(
+            user_id, [ids[i] for i in stale], embed_texts([facts[i] for i in stale]), EMBEDDER
+        )
+        ids, facts, blobs, models = memory_store.rows(user_id)
+    if not facts:
+        return [], [], np.zeros((0, 0), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(facts), -1)
+    return ids, facts, matrix
+
+def normalize_fact(fact):
+    return " ".join(re.findall(r"[a-z0-9']+", fact.lower()))
+
+def add_memories(user_id, facts):
+    # Facts that only differ from a stored one in case, spacing or punctuation
+    # are dropped outright
+    import numpy as np
+    from openai import OpenAIError
+    known = {normalize_fact(f) for f in memory_store.load(user_id)}
+    new = {}
+    for fact in facts:
+        new.setdefault(normalize_fact(fact), fact)
+    facts = [f for key, f in new.items() if key and key not in known]
+    if not facts:
+        return []
+    try:
+        embeddings = embed_texts(facts)
+        ids, stored, matrix = memory_vectors(user_id)
+    except OpenAIError:
+        return memory_store.add(user_id, facts)  # embedded later by memory_vectors
+
+    # Incremental compaction: a new fact that is close to stored ones is merged with
+    # them by EXTRACT_MODEL, which keeps facts that are only similar in wording
+    if not ids:
+        return memory_store.add(user_id, facts, embeddings, EMBEDDER)
+    similar = (embeddings @ matrix.T) >= SUPERSEDE_SIMILARITY[EMBEDDER]
+    related = np.flatnonzero(similar.any(axis=1))
+    if not len(related):
+        return memory_store.add(user_id, facts, embeddings, EMBEDDER)
+
+    separate = np.flatnonzero(~similar.any(axis=1))
+    added = memory_store.add(user_id, [facts[i] for i in separate], embeddings[separate], EMBEDDER)
+    candidates = np.flatnonzero(similar.any(axis=0))
+    old_facts = [stored[j] for j in candidates]
+    with memory_store.merge_lock(user_id):
+        merged = []
+        # Skipped if a concurrent merge has already replaced some of the candidates
+        if set(old_facts) <= set(memory_store.load(user_id)):
+            try:
+                merged = merge_memories(old_facts + [facts[i] for i in related])  # oldest first
+                merged_embeddings = embed_texts(merged) if merged else None
+            except Exception:
+                merged = []
+        if not merged:
+            # Keep everything rather than lose a fact
+            return added + memory_store.add(user_id, [facts[i] for i in related], embeddings[related], EMBEDDER)
+        replaced = memory_store.add(
+            user_id, merged, merged_embeddings, EMBEDDER, remove_ids=[ids[j] for j in candidates]
+        )
+    return added + [f for f in replaced if f not in old_facts]
+
+def clear_memories(user_id):
+    memory_store.clear(user_id)
+
+def compact_memories(user_id):
+    # Full sweep: group memories whose similarity chains above CLUSTER_SIMILARITY
+    # and have EXTRACT_MODEL merge each group. Returns how many memories were removed.
+    with memory_store.merge_lock(user_id):
+        ids, facts, matrix = memory_vectors(user_id)
+        if len(ids) < 2:
+            return 0
+        return merge_clusters(user_id, ids, facts, matrix)
 
-def extract_new_memories(user_msg, assistant_msg, existing_memories):
+def merge_clusters(user_id, ids, facts, matrix):
+    import numpy as np
+    parent = list(range(len(ids)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    pairs = np.triu((matrix @ matrix.T) >= CLUSTER_SIMILARITY[EMBEDDER], k=1)
+    for i, j in zip(*np.nonzero(pairs)):
+        parent[find(i)] = find(j)
+    clusters = {}
+    for i in range(len(ids)):
+        clusters.setdefault(find(i), []).append(i)
+
+    removed = 0
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        merged = merge_memories([facts[i] for i in members])  # members are oldest first
+        if not merged:
+            continue
+        memory_store.add(
+            user_id, merged, embed_texts(merged), EMBEDDER, remove_ids=[ids[i] for i in members]
+        )
+        removed += len(members) - len(merged)
+    return removed
+
+def select_memories(user_id, message):
+    # Top-k memories most relevant to the message that fit the token budget
+    import numpy as np
+    from openai import OpenAIError
+    if not memory_store.load(user_id):
+        return []
+    try:
+        ids, facts, matrix = memory_vectors(user_id)
+        scores = matrix @ embed_texts([message])[0]
+        order = np.argsort(-scores)
+    except OpenAIError:
+        facts = memory_store.load(user_id)
+        order = range(len(facts) - 1, -1, -1)  # embeddings unavailable: most recent first
+
+    chosen, used = [], 0
+    for i in order:
+        if len(chosen) == MEMORY_TOP_K:
+            break
+        cost = estimate_tokens(facts[i])
+        if used + cost <= MEMORY_TOKEN_BUDGET:
+            chosen.append(facts[i])
+            used += cost
+    return chosen
+
+def extract_new_memories(exchanges, existing_memories):
     existing_str = "\n".join(f"- {m}" for m in existing_memories) if existing_memories else "None"
+    conversation = "\n\n".join(f"User: {u}\nAssistant: {a}" for u, a in exchanges)
 
-    extraction_prompt = f"""You are a memory extraction assistant. Identify any NEW facts worth remembering about the user from this conversation exchange.
+    extraction_prompt = f"""You are a memory extraction assistant. Identify any NEW facts worth remembering about the user from these conversation exchanges.
 
 EXISTING MEMORIES (do NOT repeat these):
 {existing_str}
 
 CONVERSATION:
-User: {user_msg}
-Assistant: {assistant_msg}
+{conversation}
 
 Extract only new facts about the user (name, location, school, major, interests, preferences, etc.).
 Do NOT duplicate anything already in existing memories.
@@ -51,35 +364,211 @@ Respond ONLY with a valid JSON array of strings. No markdown, no explanation.
 Example: ["User's name is Alex", "User studies at MIT"]
 If nothing new: []"""
 
-    response = client.messages.create(
+    response = chat_client().messages.create(
         model=EXTRACT_MODEL,
         max_tokens=512,
         messages=[{"role": "user", "content": extraction_prompt}]
     )
 
+    return parse_fact_list(response)
+
+def merge_memories(facts):
+    numbered = "\n".join(f"{i + 1}. {f}" for i, f in enumerate(facts))
+
+    merge_prompt = f"""You are a memory compaction assistant. These stored facts about the user overlap or may conflict. They are listed oldest first.
+
+FACTS:
+{numbered}
+
+Rewrite them as the smallest set of facts that keeps every distinct piece of information.
+Merge duplicates and paraphrases into one fact. When facts conflict, keep the newer one.
+
+Respond ONLY with a valid JSON array of strings. No markdown, no explanation."""
+
+    response = chat_client().messages.create(
+        model=EXTRACT_MODEL,
+        max_tokens=512,
+        messages=[{"role": "user", "content": merge_prompt}]
+    )
+    return parse_fact_list(response)
+
+def parse_fact_list(response):
     try:
         raw = response.content[0].text.strip()
         raw = raw.replace("```json", "").replace("```", "").strip()
-        new_facts = json.loads(raw)
-        return [str(f) for f in new_facts if f] if isinstance(new_facts, list) else []
+        facts = json.loads(raw)
+        return [str(f) for f in facts if f] if isinstance(facts, list) else []
     except (json.JSONDecodeError, Exception):
         return []
 
-def build_system_prompt(memories):
-    base = "You are a helpful, friendly assistant with long-term memory."
+# Background memory extraction
+# Exchanges are queued after each reply and a single worker thread extracts them,
+# folding up to EXTRACT_BATCH_SIZE queued exchanges per user into one call. The
+# reply path never waits on EXTRACT_MODEL. Writes go through add_memories, which
+# ignores facts that are already stored. The same worker refreshes each chat's
+# history summary; the chat picks the result up on its next run.
+class MemoryExtractor:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}   # user_id -> queued exchanges not yet extracted
+        self.landed = {}    # user_id -> [(timestamp, facts)]
+        self.last_sweep = {}  # user_id -> time of the last full compaction
+        self.summarizing = set()  # summary keys with a job queued or running
+        self.summaries = {}  # summary key -> (summary, upto) not yet picked up
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, user_id, user_msg, assistant_msg, existing_memories):
+        with self.lock:
+            self.pending[user_id] = self.pending.get(user_id, 0) + 1
+        self.jobs.put(("extract", user_id, user_msg, assistant_msg, existing_memories))
+
+    def submit_summary(self, key, summary, messages, upto):
+        # Folds messages into summary; the result covers messages[:upto] of the chat
+        with self.lock:
+            if key in self.summarizing:
+                return
+            self.summarizing.add(key)
+        self.jobs.put(("summary", key, summary, messages, upto))
+
+    def take_summary(self, key):
+        with self.lock:
+            return self.summaries.pop(key, None)
+
+    def pending_count(self, user_id):
+        with self.lock:
+            return self.pending.get(user_id, 0)
+
+    def landed_since(self, user_id, since):
+        with self.lock:
+            return [facts for ts, facts in self.landed.get(user_id, []) if ts > since]
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.monotonic() + EXTRACT_BATCH_WAIT
+            while len(batch) < EXTRACT_BATCH_SIZE:
+                try:
+                    batch.append(self.jobs.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            by_user = {}
+            for kind, *job in batch:
+                if kind == "summary":
+                    self.summarize(*job)
+                    continue
+                user_id, user_msg, assistant_msg, existing = job
+                exchanges, known = by_user.setdefault(user_id, ([], {}))
+                exchanges.append((user_msg, assistant_msg))
+                known.update(dict.fromkeys(existing))
+            for user_id, (exchanges, known) in by_user.items():
+                try:
+                    added = add_memories(user_id, extract_new_memories(exchanges, list(known)))
+                except Exception:
+                    added = []
+                with self.lock:
+                    self.pending[user_id] -= len(exchanges)
+                    if added:
+                        recent = self.landed.setdefault(user_id, [])
+                        recent.append((time.time(), added))
+                        del recent[:-20]
+                if time.time() - self.last_sweep.get(user_id, 0) >= COMPACTION_INTERVAL:
+                    self.last_sweep[user_id] = time.time()
+                    try:
+                        compact_memories(user_id)
+                    except Exception:
+                        pass
+
+    def summarize(self, key, summary, messages, upto):
+        try:
+            result = summarize_history(summary, messages)
+        except Exception:
+            result = None  # the chat keeps those messages in its history and retries later
+        with self.lock:
+            self.summarizing.discard(key)
+            if result:
+                self.summaries[key] = (result, upto)
+
+@st.cache_resource
+def get_memory_extractor():
+    return MemoryExtractor()
+
+memory_extractor = get_memory_extractor()
+
+# Pick up a history summary the worker finished since the last run
+landed_summary = memory_extractor.take_summary(st.session_state.summary_key)
+if landed_summary:
+    st.session_state.history_summary, st.session_state.summary_upto = landed_summary
+
+def build_system_prompt(summary=""):
+    # The fixed instructions, then the running summary, which changes only every
+    # few turns. The per-turn memories are sent by build_messages instead.
+    blocks = ["You are a helpful, friendly assistant with long-term memory."]
+    if summary:
+        blocks.append(f"Summary of earlier parts of this conversation:\n{summary}")
+    return [{"type": "text", "text": b} for b in blocks]
+
+def build_messages(history, memories):
+    # The cache breakpoint goes on the newest message, so the next turn reads the
+    # system prompt and this whole history from the prompt cache (once the prefix
+    # passes the provider's 1024-token minimum). The memories are re-selected for
+    # every message, so they follow the breakpoint in the same user turn.
+    *earlier, last = history
+    content = [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}]
     if memories:
         memory_block = "\n".join(f"- {m}" for m in memories)
-        return (
-            f"{base}\n\n"
-            f"Here are things you remember about this user from past conversations:\n"
-            f"{memory_block}"
-        )
-    return base
+        content.append({
+            "type": "text",
+            "text": f"Here are things you remember about this user from past conversations:\n{memory_block}",
+        })
+    return earlier + [{"role": last["role"], "content": content}]
+
+# History window
+# Only the newest messages that fit HISTORY_TOKEN_BUDGET are sent. Older turns can
+# be folded into a running summary, refreshed in the background every
+# SUMMARY_BATCH_MESSAGES. Until a message is in the summary it stays in the
+# history, even past the budget, so the model always sees every message one way.
+def history_window_start(messages):
+    used, start = 0, len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[i]["content"])
+        if used > HISTORY_TOKEN_BUDGET and start < len(messages):
+            break
+        start = i
+    # The messages API expects the history to open with a user turn
+    while start < len(messages) - 1 and messages[start]["role"] != "user":
+        start += 1
+    return start
+
+def history_start(messages, use_summary):
+    start = history_window_start(messages)
+    return min(start, st.session_state.summary_upto) if use_summary else start
+
+def summarize_history(summary, messages):
+    transcript = "\n".join(f"{m['role'].title()}: {m['content']}" for m in messages)
+    response = chat_client().messages.create(
+        model=EXTRACT_MODEL,
+        max_tokens=400,
+        messages=[{
+            "role": "user",
+            "content": (
+                "Update this running summary of a conversation with the new messages below. "
+                "Keep it under 150 words and keep anything the assistant may need later.\n\n"
+                f"CURRENT SUMMARY:\n{summary or 'None'}\n\nNEW MESSAGES:\n{transcript}\n\n"
+                "Respond with the updated summary only."
+            ),
+        }],
+    )
+    return response.content[0].text.strip()
 
 # Sidebar
 st.sidebar.header("🧠 Long-Term Memory")
 
-memories = load_memories()
+user_id = st.sidebar.text_input("Memory profile", value=DEFAULT_USER).strip() or DEFAULT_USER
+
+memories = load_memories(user_id)
 
 if memories:
     st.sidebar.write(f"**{len(memories)} memor{'y' if len(memories) == 1 else 'ies'} stored:**")
@@ -90,18 +579,57 @@ else:
 
 st.sidebar.divider()
 
+if st.sidebar.button("🧹 Compact Memories", disabled=len(memories) < 2):
+    with st.sidebar:
+        with st.spinner("Merging near-duplicate memories…"):
+            try:
+                removed = compact_memories(user_id)
+            except Exception as e:
+                removed = None
+                st.error(f"Could not compact memories: {e}")
+    if removed is not None:
+        st.session_state.memory_toasts.append(f"🧹 {removed} duplicate memor{'y' if removed == 1 else 'ies'} merged")
+        st.rerun()
+
 if st.sidebar.button("🗑️ Clear All Memories"):
-    save_memories([])
+    clear_memories(user_id)
     st.rerun()
 
 if st.sidebar.button("🗑️ Clear Chat History"):
     st.session_state.messages = []
+    st.session_state.history_summary = ""
+    st.session_state.summary_upto = 0
+    st.session_state.summary_key = uuid.uuid4().hex  # a summary still running is for the old chat
     st.rerun()
 
+use_summary = st.sidebar.toggle("Summarise older turns", value=True)
+
 st.sidebar.divider()
 st.sidebar.write(f"**Model:** {CHAT_MODEL}")
+st.sidebar.write(f"**Memory retrieval:** top {MEMORY_TOP_K} by {EMBEDDER}")
 st.sidebar.write(f"**Messages in session:** {len(st.session_state.messages)}")
 
+# Memory status: polls the background extractor and refreshes the page when new
+# memories land
+@st.fragment(run_every=2)
+def memory_status():
+    landed = memory_extractor.landed_since(user_id, st.session_state.memories_seen_at)
+    if landed:
+        st.session_state.memories_seen_at = time.time()
+        st.session_state.memory_toasts.extend(
+            f"✦ New memor{'y' if len(facts) == 1 else 'ies'} saved: {', '.join(facts)}" for facts in landed
+        )
+        st.rerun(scope="app")
+    if memory_extractor.pending_count(user_id):
+        st.caption("⏳ Extracting memories in the background…")
+
+with st.sidebar:
+    memory_status()
+
+for toast in st.session_state.memory_toasts:
+    st.toast(toast)
+st.session_state.memory_toasts = []
+
 # Chat display
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -114,26 +642,36 @@ if prompt := st.chat_input("Say something — I'll remember what matters..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    current_memories = load_memories()
-    system_prompt = build_system_prompt(current_memories)
+    current_memories = select_memories(user_id, prompt)
+    summary = st.session_state.history_summary if use_summary else ""
+    system_prompt = build_system_prompt(summary)
+    history = build_messages(
+        st.session_state.messages[history_start(st.session_state.messages, use_summary):], current_memories
+    )
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response = client.messages.create(
-                model=CHAT_MODEL,
-                max_tokens=1024,
-                system=system_prompt,
-                messages=st.session_state.messages,
-            )
-            reply = response.content[0].text
-        st.markdown(reply)
+        with chat_client().messages.stream(
+            model=CHAT_MODEL,
+            max_tokens=1024,
+            system=system_prompt,
+            messages=history,
+        ) as stream:
+            reply = st.write_stream(stream.text_stream)
 
-        # Extract and save new memories
-        new_facts = extract_new_memories(prompt, reply, current_memories)
-        if new_facts:
-            updated = current_memories + new_facts
-            save_memories(updated)
-            st.info(f"✦ New memor{'y' if len(new_facts) == 1 else 'ies'} saved: {', '.join(new_facts)}")
+    # Extract and save new memories off the reply path
+    memory_extractor.submit(user_id, prompt, reply, current_memories)
 
     st.session_state.messages.append({"role": "assistant", "content": reply})
+
+    # Fold messages that have left the window into the summary, a batch at a time,
+    # off the reply path
+    if use_summary:
+        start = history_window_start(st.session_state.messages)
+        if start - st.session_state.summary_upto >= SUMMARY_BATCH_MESSAGES:
+            memory_extractor.submit_summary(
+                st.session_state.summary_key,
+                st.session_state.history_summary,
+                st.session_state.messages[st.session_state.summary_upto:start],
+                start,
+            )
     st.rerun()
\ No newline at end of file
@@ -0,0 +1,889 @@
+"""Shared gateway for every outbound model and API call made by the Labs.
+
+Each page asks this module for its OpenAI, Anthropic, LangChain or plain HTTP
+client instead of building one itself. Every client sends its traffic through
+GatewayTransport, an httpx transport that adds:
+
+- an opt-in disk cache keyed by method, URL and request body (streamed
+  responses are cached too and replayed event by event); live data such as
+  the weather and answers that use web search are never cached,
+- admission through scheduler.py, which enforces per-provider rate limits
+  and orders waiting requests by priority and session,
+- retries with exponential backoff on 429/5xx and connection errors; a 429
+  pauses the provider for every caller,
+- single flight: identical requests in progress at the same time share one
+  upstream call, and a streamed body is fanned out to every waiting caller,
+- record/replay: "record" stores every response, "replay" serves recorded
+  traffic only and never touches the network,
+- a telemetry span per call with latency, time to first byte and token usage.
+
+Configuration comes from environment variables (root-level entries in
+.streamlit/secrets.toml are exported as environment variables by Streamlit):
+
+    LLM_GATEWAY_MODE         live (default) | record | replay
+    LLM_GATEWAY_CACHE        1 to serve repeat calls from disk in live mode (default 0)
+    LLM_GATEWAY_CACHE_TTL    seconds a cached response is kept in live mode (default 3600)
+    LLM_GATEWAY_DIR          where responses are stored (default .llm_gateway)
+    LLM_GATEWAY_MAX_RETRIES  upstream retries per request (default 3)
+    LLM_GATEWAY_COALESCE     1 (default) to share identical in-flight requests
+    LLM_GATEWAY_UPSTREAM     base URL (e.g. http://127.0.0.1:8765) that provider
+                             calls are sent to instead, used by mock_server.py
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import zlib
+from importlib import metadata
+from urllib.parse import parse_qsl, urlencode
+
+import scheduler
+import telemetry
+
+
+def sdk_httpx():
+    # The transports and streams below must come from the same httpx module as
+    # the SDK clients they are mounted on, and some SDK releases are built on the
+    # renamed httpx2 fork. Read it from the installed SDKs' requirements, which is
+    # much cheaper than importing them.
+    for package in ("openai", "anthropic"):
+        try:
+            requirements = metadata.requires(package) or []
+        except metadata.PackageNotFoundError:
+            continue
+        if any(re.match(r"httpx2\b", requirement) for requirement in requirements):
+            return importlib.import_module("httpx2")
+    return importlib.import_module("httpx")
+
+
+httpx = sdk_httpx()
+HTTPError = httpx.HTTPError  # for pages that call http_get() and handle its errors
+InvalidURL = httpx.InvalidURL  # raised for a malformed URL, which is not an HTTPError
+
+MODE = os.environ.get("LLM_GATEWAY_MODE", "live").lower()
+CACHE_ENABLED = os.environ.get("LLM_GATEWAY_CACHE", "0") not in ("0", "false", "no")
+CACHE_TTL = float(os.environ.get("LLM_GATEWAY_CACHE_TTL", 60 * 60))
+PRUNE_INTERVAL = 10 * 60  # seconds between sweeps of expired cache entries
+STORE_DIR = os.environ.get("LLM_GATEWAY_DIR", ".llm_gateway")
+MAX_RETRIES = int(os.environ.get("LLM_GATEWAY_MAX_RETRIES", 3))
+UPSTREAM = os.environ.get("LLM_GATEWAY_UPSTREAM")
+COALESCE = os.environ.get("LLM_GATEWAY_COALESCE", "1") not in ("0", "false", "no")
+FLIGHT_IDLE_TIMEOUT = 120.0  # seconds a follower waits for the next chunk
+RETRY_BASE_DELAY = 0.5  # seconds, doubled on each retry
+RETRY_MAX_DELAY = 20.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Query parameters that carry credentials and must not end up in cache keys
+SECRET_PARAMS = {"appid", "api_key", "apikey", "key"}
+# Hosts that serve live data, which the cache must never answer for
+UNCACHED_HOSTS = {"api.openweathermap.org"}
+# Hop-by-hop headers that no longer describe a replayed body
+DROPPED_HEADERS = {"content-length", "transfer-encoding", "connection", "keep-alive"}
+# Hosts whose calls are reported to telemetry as tool calls rather than plain HTTP
+TOOL_HOSTS = {"api.openweathermap.org": "weather"}
+METER_BODY_LIMIT = 4 * 1024 * 1024  # bytes of a response kept for usage parsing
+# Hosts redirected to LLM_GATEWAY_UPSTREAM when it is set
+PROVIDER_HOSTS = set(scheduler.PROVIDER_HOSTS)
+
+
+# Cache keys and the response store
+
+def request_key(request: httpx.Request) -> str:
+    query = [(k, v) for k, v in parse_qsl(request.url.query.decode()) if k.lower() not in SECRET_PARAMS]
+    url = request.url.copy_with(query=urlencode(sorted(query)).encode() or None)
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), str(url).encode(), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cacheable(request: httpx.Request) -> bool:
+    # Whether the live-mode cache may serve this request. Record/replay keeps
+    # every request, since recordings are fixtures rather than a cache. Callers
+    # opt a request out with extensions={"gateway_cache": False}.
+    if request.url.host in UNCACHED_HOSTS or request.extensions.get("gateway_cache") is False:
+        return False
+    try:
+        tools = json.loads(request.content).get("tools") or []
+    except (ValueError, AttributeError):
+        return True
+    return not any(str(tool.get("type", "")).startswith("web_search") for tool in tools if isinstance(tool, dict))
+
+
+def store_dir() -> str:
+    # The live-mode cache is kept apart from recordings so pruning never touches them
+    return STORE_DIR if MODE != "live" else os.path.join(STORE_DIR, "cache")
+
+
+def entry_path(key: str) -> str:
+    return os.path.join(store_dir(), key[:2], f"{key}.json")
+
+
+def load_entry(key: str, ttl: float | None):
+    try:
+        with open(entry_path(key), "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if ttl is not None and time.time() - entry["created_at"] > ttl:
+        return None
+    return entry
+
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def prune_store():
+    # Deletes cache entries older than CACHE_TTL. An entry's file is written once,
+    # so its mtime is its creation time.
+    cutoff = time.time() - CACHE_TTL
+    for root, _, files in os.walk(store_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass  # removed by another process meanwhile
+
+
+def maybe_prune():
+    global _last_prune
+    if MODE != "live":
+        return
+    with _prune_lock:
+        if _last_prune and time.monotonic() - _last_prune < PRUNE_INTERVAL:
+            return
+        _last_prune = time.monotonic()
+    threading.Thread(target=prune_store, name="gateway-prune", daemon=True).start()
+
+
+def save_entry(key: str, request: httpx.Request, response: httpx.Response, body: bytes):
+    maybe_prune()
+    path = entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {
+        "created_at": time.time(),
+        "method": request.method,
+        "url": str(request.url.copy_with(query=None)),
+        "status": response.status_code,
+        "headers": [(k, v) for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS],
+        "body": base64.b64encode(body).decode("ascii"),
+    }
+    # Write to a temp file first so concurrent readers never see half an entry
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+
+def replay_chunks(entry) -> list[bytes]:
+    body = base64.b64decode(entry["body"])
+    headers = dict((k.lower(), v) for k, v in entry["headers"])
+    # Server-sent events are handed back one event at a time, like the original stream
+    if "text/event-stream" in headers.get("content-type", "") and "content-encoding" not in headers:
+        return [event + b"\n\n" for event in body.split(b"\n\n") if event]
+    return [body]
+
+
+def lookup(request: httpx.Request, key: str):
+    if MODE == "replay":
+        entry = load_entry(key, ttl=None)
+        if entry is None:
+            raise httpx.ConnectError(f"replay mode: no recording for {request.method} {request.url.path}", request=request)
+        return entry
+    if MODE == "live" and CACHE_ENABLED and cacheable(request):
+        return load_entry(key, ttl=CACHE_TTL)
+    return None
+
+
+def should_store(request: httpx.Request, response: httpx.Response) -> bool:
+    if response.status_code >= 400:
+        return False
+    return MODE == "record" or (MODE == "live" and CACHE_ENABLED and cacheable(request))
+
+
+def upstream_request(request: httpx.Request) -> httpx.Request:
+    # The request actually sent upstream. Cache keys and telemetry keep using the
+    # original request, so a run against the mock server looks like a real one.
+    if not UPSTREAM or request.url.host not in PROVIDER_HOSTS:
+        return request
+    base = httpx.URL(UPSTREAM)
+    url = request.url.copy_with(scheme=base.scheme, host=base.host, port=base.port)
+    headers = [(k, v) for k, v in request.headers.raw if k.lower() != b"host"]
+    return httpx.Request(request.method, url, headers=headers, content=request.content,
+                         extensions=request.extensions)
+
+
+def retry_delay(response: httpx.Response | None, attempt: int) -> float:
+    if response is not None:
+        try:
+            return min(float(response.headers["retry-after"]), RETRY_MAX_DELAY)
+        except (KeyError, ValueError):
+            pass
+    return min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+
+
+# Streams that copy the upstream body into the store while the caller reads it
+
+class TeeStream(httpx.SyncByteStream):
+    def __init__(self, key, request, response):
+        self.key, self.request, self.response = key, request, response
+
+    def __iter__(self):
+        chunks = []
+        for chunk in self.response.stream:
+            chunks.append(chunk)
+            yield chunk
+        save_entry(self.key, self.request, self.response, b"".join(chunks))
+
+    def close(self):
+        self.response.close()
+
+
+class AsyncTeeStream(httpx.AsyncByteStream):
+    def __init__(self, key, request, response):
+        self.key, self.request, self.response = key, request, response
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self.response.stream:
+            chunks.append(chunk)
+            yield chunk
+        save_entry(self.key, self.request, self.response, b"".join(chunks))
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+class ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def replay_response(entry, request: httpx.Request) -> httpx.Response:
+    return httpx.Response(
+        entry["status"],
+        headers=entry["headers"] + [("x-llm-gateway", "replay")],
+        stream=ReplayStream(replay_chunks(entry)),
+        request=request,
+    )
+
+
+def passthrough_response(stream, response: httpx.Response, request: httpx.Request) -> httpx.Response:
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        stream=stream,
+        extensions=response.extensions,
+        request=request,
+    )
+
+
+# Single flight: the first caller of a request (the leader) sends it upstream and
+# publishes each chunk of the response body to a Flight. Identical requests that
+# arrive while it is in progress (followers) wait for the leader's response
+# headers, then read the chunks published so far and new ones as they arrive.
+# Followers wait without a limit while the leader is queued in the scheduler; the
+# idle timeout runs from the leader's latest admission.
+# The flight is dropped once the body is complete; later repeats are served by
+# the cache, or go upstream again when it is off.
+
+class Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.response = None  # the leader's upstream response, once headers are in
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.admitted_at = None  # when the leader was last admitted upstream
+
+    def admitted(self):
+        with self.cond:
+            self.admitted_at = time.monotonic()
+            self.cond.notify_all()
+
+    def start(self, response):
+        with self.cond:
+            self.response = response
+            self.cond.notify_all()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            if not self.done:
+                self.done, self.error = True, error
+                self.cond.notify_all()
+
+    def wait_response(self):
+        with self.cond:
+            while self.response is None and not self.done:
+                if self.admitted_at is None:
+                    self.cond.wait()
+                    continue
+                remaining = self.admitted_at + FLIGHT_IDLE_TIMEOUT - time.monotonic()
+                if remaining <= 0:
+                    raise httpx.ReadTimeout("coalesced request did not start")
+                self.cond.wait(remaining)
+            if self.response is None:
+                raise self.error
+            return self.response
+
+    def wait_chunk(self, index):
+        # The chunk at index, or None once the body is complete
+        with self.cond:
+            if not self.cond.wait_for(lambda: index < len(self.chunks) or self.done, FLIGHT_IDLE_TIMEOUT):
+                raise httpx.ReadTimeout("coalesced request stalled")
+            if index < len(self.chunks):
+                return self.chunks[index]
+            if self.error is not None:
+                raise self.error
+            return None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+_drains = set()  # drain tasks of abandoned async leaders, kept until they finish
+
+
+def join_flight(key: str) -> tuple[Flight, bool]:
+    # Returns the flight for key and whether the caller leads it
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            with flight.cond:
+                flight.followers += 1
+            return flight, False
+        flight = _flights[key] = Flight()
+        return flight, True
+
+
+def land_flight(key: str, flight: Flight, error: BaseException | None = None):
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+    if error is not None and not isinstance(error, Exception):
+        error = httpx.ReadError("coalesced request was cancelled")  # e.g. CancelledError
+    flight.finish(error)
+
+
+class LeaderStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    # The leader's body, published to the flight as the leader reads it. If the
+    # leader stops early while others are waiting, the rest is read on their behalf
+    # by a background thread (or task), which then closes the upstream response.
+    def __init__(self, key, flight, inner):
+        self.key, self.flight, self.inner = key, flight, inner
+        self.iterator = None
+        self.draining = False
+
+    def __iter__(self):
+        self.iterator = self.iterator or iter(self.inner)
+        try:
+            for chunk in self.iterator:
+                self.flight.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            self.abandon()
+            raise
+        except BaseException as e:
+            land_flight(self.key, self.flight, e)
+            raise
+        land_flight(self.key, self.flight)
+
+    async def __aiter__(self):
+        self.iterator = self.iterator or self.inner.__aiter__()
+        try:
+            async for chunk in self.iterator:
+                self.flight.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            await self.aabandon()
+            raise
+        except BaseException as e:
+            land_flight(self.key, self.flight, e)
+            raise
+        land_flight(self.key, self.flight)
+
+    def abandon(self):
+        # Returns True if the rest of the body is being drained for the followers
+        if self.draining or self.flight.done:
+            return self.draining
+        if not self.flight.followers:
+            land_flight(self.key, self.flight, httpx.ReadError("leader stopped reading"))
+            return False
+        self.draining = True
+        threading.Thread(target=self.drain, name="flight-drain", daemon=True).start()
+        return True
+
+    async def aabandon(self):
+        if self.draining or self.flight.done:
+            return self.draining
+        if not self.flight.followers:
+            land_flight(self.key, self.flight, httpx.ReadError("leader stopped reading"))
+            return False
+        self.draining = True
+        task = asyncio.get_running_loop().create_task(self.adrain())
+        _drains.add(task)
+        task.add_done_callback(_drains.discard)
+        return True
+
+    def drain(self):
+        try:
+            for chunk in self.iterator or self.inner:
+                self.flight.publish(chunk)
+        except Exception as e:
+            land_flight(self.key, self.flight, e)
+        else:
+            land_flight(self.key, self.flight)
+        finally:
+            self.inner.close()
+
+    async def adrain(self):
+        try:
+            async for chunk in self.iterator or self.inner:
+                self.flight.publish(chunk)
+        except BaseException as e:  # followers are told if the loop cancels the drain
+            land_flight(self.key, self.flight, e)
+        else:
+            land_flight(self.key, self.flight)
+        finally:
+            await self.inner.aclose()
+
+    def close(self):
+        if not self.abandon():
+            self.inner.close()
+
+    async def aclose(self):
+        if not await self.aabandon():
+            await self.inner.aclose()
+
+
+class FollowerStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, flight):
+        self.flight = flight
+
+    def __iter__(self):
+        index = 0
+        while (chunk := self.flight.wait_chunk(index)) is not None:
+            yield chunk
+            index += 1
+
+    async def __aiter__(self):
+        index = 0
+        while (chunk := await asyncio.to_thread(self.flight.wait_chunk, index)) is not None:
+            yield chunk
+            index += 1
+
+
+def lead(key: str, flight: Flight, response: httpx.Response, request: httpx.Request) -> httpx.Response:
+    flight.start(response)
+    return passthrough_response(LeaderStream(key, flight, response.stream), response, request)
+
+
+def follow(flight: Flight, response: httpx.Response, request: httpx.Request) -> httpx.Response:
+    return httpx.Response(response.status_code, headers=response.headers,
+                          stream=FollowerStream(flight), request=request)
+
+
+# Telemetry: every response is wrapped in a MeteredStream that notes when the
+# first byte arrives and, once the body has been read, records a span with the
+# token usage parsed from it
+
+def span_kind(request: httpx.Request) -> tuple[str, str]:
+    path = request.url.path
+    if path.endswith("/embeddings"):
+        return "embedding", path
+    if path.endswith(("/chat/completions", "/responses", "/messages")):
+        return "model", path
+    host = request.url.host
+    return ("tool", TOOL_HOSTS[host]) if host in TOOL_HOSTS else ("http", host)
+
+
+def request_model(request: httpx.Request):
+    try:
+        return json.loads(request.content).get("model")
+    except (ValueError, AttributeError):
+        return None
+
+
+def decode_body(headers, raw: bytes) -> bytes:
+    encoding = headers.get("content-encoding", "")
+    try:
+        if encoding == "gzip":
+            return zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+        if encoding == "deflate":
+            return zlib.decompress(raw)
+        if encoding == "br":
+            import brotli
+            return brotli.decompress(raw)
+    except Exception:
+        return b""
+    return raw
+
+
+def find_usage(data):
+    # OpenAI chat/embeddings and Anthropic put usage at the top level, the Responses
+    # API stream under "response", and Anthropic's message_start under "message"
+    if not isinstance(data, dict):
+        return None
+    for holder in (data, data.get("response"), data.get("message")):
+        if isinstance(holder, dict) and isinstance(holder.get("usage"), dict):
+            return holder["usage"]
+    return None
+
+
+def merge_usage(totals, usage):
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", usage.get("prompt_tokens"))
+    if input_tokens is not None:
+        input_tokens += (usage.get("cache_read_input_tokens") or 0) + (usage.get("cache_creation_input_tokens") or 0)
+        totals["input"] = max(totals.get("input", 0), input_tokens)
+    output_tokens = usage.get("output_tokens", usage.get("completion_tokens"))
+    if output_tokens is not None:
+        totals["output"] = max(totals.get("output", 0), output_tokens)
+
+
+def parse_usage(headers, raw: bytes):
+    # Returns (input_tokens, output_tokens, estimated); estimated is True when a
+    # stream carried no usage and the output count was guessed from its text
+    body = decode_body(headers, raw)
+    totals = {}
+    estimated = False
+    if "text/event-stream" in headers.get("content-type", ""):
+        streamed_chars = 0
+        for line in body.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                data = json.loads(line[5:])
+            except ValueError:
+                continue
+            merge_usage(totals, find_usage(data))
+            if not isinstance(data, dict):
+                continue
+            for choice in data.get("choices") or []:
+                streamed_chars += len((choice.get("delta") or {}).get("content") or "")
+        # Chat streams carry usage in their last chunk only when the caller sets
+        # stream_options.include_usage; otherwise estimate 1 token ≈ 4 characters
+        if "output" not in totals and streamed_chars:
+            totals["output"] = streamed_chars // 4 + 1
+            estimated = True
+    elif "json" in headers.get("content-type", ""):
+        try:
+            merge_usage(totals, find_usage(json.loads(body)))
+        except ValueError:
+            pass
+    return totals.get("input"), totals.get("output"), estimated
+
+
+class MeteredStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, inner, request, response, start, source):
+        self.inner, self.request, self.response = inner, request, response
+        self.start, self.source = start, source
+        self.first_byte = None
+        self.chunks, self.size = [], 0
+        self.recorded = False
+        content_type = response.headers.get("content-type", "")
+        self.keep_body = "json" in content_type or "event-stream" in content_type
+
+    def observe(self, chunk):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()
+        if self.keep_body and self.size < METER_BODY_LIMIT:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+
+    def finish(self):
+        if self.recorded:
+            return
+        self.recorded = True
+        kind, name = span_kind(self.request)
+        input_tokens, output_tokens, estimated = parse_usage(self.response.headers, b"".join(self.chunks))
+        status = self.response.status_code
+        ticket = self.response.extensions.get("scheduler_ticket")
+        if ticket is not None:
+            if input_tokens is not None or output_tokens is not None:
+                ticket.settle((input_tokens or 0) + (output_tokens or 0))
+            ticket.release()
+        telemetry.record(
+            kind,
+            name,
+            time.perf_counter() - self.start,
+            ttft=self.first_byte - self.start if self.first_byte else None,
+            model=request_model(self.request),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            usage_estimated=estimated,
+            cached=self.source == "cache",
+            coalesced=self.source == "flight",
+            queued=round(ticket.waited, 4) if ticket is not None else None,
+            error=f"HTTP {status}" if status >= 400 else None,
+        )
+
+    def __iter__(self):
+        for chunk in self.inner:
+            self.observe(chunk)
+            yield chunk
+        self.finish()
+
+    async def __aiter__(self):
+        async for chunk in self.inner:
+            self.observe(chunk)
+            yield chunk
+        self.finish()
+
+    def close(self):
+        self.finish()
+        self.inner.close()
+
+    async def aclose(self):
+        self.finish()
+        await self.inner.aclose()
+
+
+def metered(response: httpx.Response, request: httpx.Request, start: float, source: str) -> httpx.Response:
+    # source is "upstream", "cache" or "flight" (shared with an identical request)
+    return passthrough_response(MeteredStream(response.stream, request, response, start, source), response, request)
+
+
+def record_failure(request: httpx.Request, start: float, error: Exception):
+    kind, name = span_kind(request)
+    telemetry.record(kind, name, time.perf_counter() - start, model=request_model(request), error=type(error).__name__)
+
+
+# Transports
+
+class GatewayTransport(httpx.BaseTransport):
+    def __init__(self, inner: httpx.BaseTransport | None = None):
+        self.inner = inner or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response, source = self.send(request)
+        except httpx.TransportError as e:
+            record_failure(request, start, e)
+            raise
+        return metered(response, request, start, source)
+
+    def send(self, request: httpx.Request) -> tuple[httpx.Response, str]:
+        request.read()
+        key = request_key(request)
+        entry = lookup(request, key)
+        if entry is not None:
+            return replay_response(entry, request), "cache"
+        if not COALESCE:
+            return self.fetch(request, key), "upstream"
+
+        flight, leader = join_flight(key)
+        if not leader:
+            return follow(flight, flight.wait_response(), request), "flight"
+        try:
+            response = self.fetch(request, key, flight)
+        except BaseException as e:
+            land_flight(key, flight, e)
+            raise
+        return lead(key, flight, response, request), "upstream"
+
+    def fetch(self, request: httpx.Request, key: str, flight: Flight | None = None) -> httpx.Response:
+        upstream = upstream_request(request)
+        ticket = scheduler.admit(request.url.host, request.url.path, request.content)
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                if attempt:
+                    ticket.retry()
+                if flight is not None:
+                    flight.admitted()
+                try:
+                    response = self.inner.handle_request(upstream)
+                except httpx.TransportError as e:
+                    # A URL with an unsupported scheme fails the same way every time
+                    if attempt == MAX_RETRIES or isinstance(e, httpx.UnsupportedProtocol):
+                        raise
+                    time.sleep(retry_delay(None, attempt))
+                    continue
+                if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                    response.close()
+                    delay = retry_delay(response, attempt)
+                    if response.status_code == 429:
+                        ticket.pause(delay)
+                    time.sleep(delay)
+                    continue
+                break
+        except BaseException:
+            ticket.release()
+            raise
+
+        # Released by MeteredStream once the body has been read
+        response.extensions["scheduler_ticket"] = ticket
+        if should_store(request, response):
+            return passthrough_response(TeeStream(key, request, response), response, request)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport | None = None):
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response, source = await self.send(request)
+        except httpx.TransportError as e:
+            record_failure(request, start, e)
+            raise
+        return metered(response, request, start, source)
+
+    async def send(self, request: httpx.Request) -> tuple[httpx.Response, str]:
+        await request.aread()
+        key = request_key(request)
+        entry = lookup(request, key)
+        if entry is not None:
+            return replay_response(entry, request), "cache"
+        if not COALESCE:
+            return await self.fetch(request, key), "upstream"
+
+        flight, leader = join_flight(key)
+        if not leader:
+            return follow(flight, await asyncio.to_thread(flight.wait_response), request), "flight"
+        try:
+            response = await self.fetch(request, key, flight)
+        except BaseException as e:
+            land_flight(key, flight, e)
+            raise
+        return lead(key, flight, response, request), "upstream"
+
+    async def fetch(self, request: httpx.Request, key: str, flight: Flight | None = None) -> httpx.Response:
+        upstream = upstream_request(request)
+        # Priority and session are read here, in the caller's thread
+        ticket = await asyncio.to_thread(
+            scheduler.admit, request.url.host, request.url.path, request.content,
+            scheduler.current_priority(), scheduler.current_session(),
+        )
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                if attempt:
+                    await asyncio.to_thread(ticket.retry)
+                if flight is not None:
+                    flight.admitted()
+                try:
+                    response = await self.inner.handle_async_request(upstream)
+                except httpx.TransportError as e:
+                    # A URL with an unsupported scheme fails the same way every time
+                    if attempt == MAX_RETRIES or isinstance(e, httpx.UnsupportedProtocol):
+                        raise
+                    await asyncio.sleep(retry_delay(None, attempt))
+                    continue
+                if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                    await response.aclose()
+                    delay = retry_delay(response, attempt)
+                    if response.status_code == 429:
+                        ticket.pause(delay)
+                    await asyncio.sleep(delay)
+                    continue
+                break
+        except BaseException:
+            ticket.release()
+            raise
+
+        response.extensions["scheduler_ticket"] = ticket
+        if should_store(request, response):
+            return passthrough_response(AsyncTeeStream(key, request, response), response, request)
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+# Clients, shared per process so connections are pooled across reruns and sessions.
+# SDK retries are turned off because the gateway already retries.
+
+def check_sdk(package, client_class):
+    if not issubclass(client_class, httpx.Client):
+        raise RuntimeError(
+            f"{package} is built on {client_class.__module__.split('.')[0]}, but the gateway uses "
+            f"{httpx.__name__}; install SDK versions that share one httpx package"
+        )
+
+@functools.lru_cache(maxsize=None)
+def openai_client(api_key: str):
+    from openai import DefaultHttpxClient, OpenAI
+
+    check_sdk("openai", DefaultHttpxClient)
+    return OpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(transport=GatewayTransport()),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def anthropic_client(api_key: str):
+    from anthropic import Anthropic, DefaultHttpxClient
+
+    check_sdk("anthropic", DefaultHttpxClient)
+    return Anthropic(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(transport=GatewayTransport()),
+    )
+
+
+def chat_openai(**kwargs):
+    from langchain_openai import ChatOpenAI
+    from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+
+    check_sdk("openai", DefaultHttpxClient)
+    return ChatOpenAI(
+        max_retries=0,
+        stream_usage=True,
+        http_client=DefaultHttpxClient(transport=GatewayTransport()),
+        http_async_client=DefaultAsyncHttpxClient(transport=AsyncGatewayTransport()),
+        **kwargs,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def http_client() -> httpx.Client:
+    return httpx.Client(transport=GatewayTransport(), follow_redirects=True)
+
+
+def http_get(url: str, **kwargs) -> httpx.Response:
+    return http_client().get(url, **kwargs)
+
+
+def http_stream(url: str, **kwargs):
+    # Context manager for a GET whose body is read incrementally
+    return http_client().stream("GET", url, **kwargs)
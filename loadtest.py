@@ -0,0 +1,331 @@
+"""Multi-session load test for the Labs, run against the local mock APIs.
+
+Each simulated session is a Streamlit AppTest instance that loads a page and
+then plays that page's scenario (chat turns, button clicks, follow-ups). All
+sessions share this process, so st.cache_resource objects, the Lab 4 index and
+the gateway clients are shared exactly as on the real server. Provider calls
+go through llm_gateway to mock_server.py, which gives every run the same
+latency, streaming rate and rate limiting.
+
+    python loadtest.py --sessions 50 --latency 0.3 --stream-rate 40 --rate-limit 0.05
+    python loadtest.py --pages Lab3 Lab4 --sessions 20 --max-p95 5 --max-error-rate 0.01
+
+For each page it reports the cold first load, then for a burst of concurrent
+sessions: completed interactions per second, p50/p95 latency of page loads and
+of interactions, errors, upstream requests seen by the mock and process RSS. The exit status is 1 when a --max-* gate fails, so the command can
+serve as a regression check for performance work.
+
+Lab 2 summarises one of the Lab 4 syllabi, so every session uploads the same
+handout. Streamlit versions whose AppTest cannot upload files measure Lab 1 and
+Lab 2 on page load only. Lab 8 captions an image URL served by the mock.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+from mock_server import MockServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["Lab1", "Lab2", "Lab3", "Lab4", "Lab5", "Lab6a", "Lab6b", "Lab8", "Lab9"]
+MOCK_SECRETS = {
+    "OPENAI_API_KEY": "sk-loadtest",
+    "ANTHROPIC_API_KEY": "sk-ant-loadtest",
+    "OPENWEATHERMAP_API_KEY": "loadtest",
+}
+HANDOUT = "IST 488 Syllabus - Building Human-Centered AI Applications.pdf"
+UPLOADS = hasattr(AppTest, "file_uploader")  # AppTest file uploads need a recent Streamlit
+
+
+# Scenario steps: each takes (AppTest, session index, mock server URL) and runs the app
+
+def find(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+def load(at, index, mock_url):
+    at.run()
+
+
+def chat(text):
+    def step(at, index, mock_url):
+        at.chat_input[0].set_value(text).run()
+    return step
+
+
+def type_text(label, text, key=None):
+    def step(at, index, mock_url):
+        widget = at.text_input(key=key) if key else find(at.text_input, label)
+        widget.set_value(text).run()
+    return step
+
+
+def click(label):
+    def step(at, index, mock_url):
+        find(at.button, label).click().run()
+    return step
+
+
+def upload(label, path, mime):
+    def step(at, index, mock_url):
+        with open(path, "rb") as f:
+            content = f.read()
+        find(at.file_uploader, label).set_value((os.path.basename(path), content, mime)).run()
+    return step
+
+
+def ask_about_document(at, index, mock_url):
+    find(at.text_area, "Now ask a question about the document!").set_value("Can you give me a short summary?").run()
+
+
+def caption_url(at, index, mock_url):
+    find(at.text_input, "Image URL").set_value(f"{mock_url}/image.png?session={index}")
+    find(at.button, "Generate Caption for Inputted URL").click().run()
+
+
+def memory_profile(at, index, mock_url):
+    # Separate profiles, as separate students would have
+    at.run()
+    find(at.sidebar.text_input, "Memory profile").set_value(f"loadtest-{index}").run()
+
+
+SCENARIOS = {
+    "Lab1": [("load", load)] + ([
+             ("upload", upload("Upload a document (.txt or .md)", os.path.join(ROOT, "README.md"), "text/markdown")),
+             ("ask", ask_about_document)] if UPLOADS else []),
+    "Lab2": [("load", load)] + ([
+             ("upload", upload("Upload a PDF document", os.path.join(ROOT, "lab4pdfs", HANDOUT), "application/pdf")),
+             ("summary", click("Generate Summary"))] if UPLOADS else []),
+    "Lab3": [("load", load),
+             ("chat", chat("What is retrieval-augmented generation?")),
+             ("chat", chat("Can you give me a short example?"))],
+    "Lab4": [("load", load),
+             ("chat", chat("What are the prerequisites for IST 488?")),
+             ("chat", chat("How is IST 256 graded?"))],
+    "Lab5": [("load", load),
+             ("type", type_text("Enter a city:", "Syracuse, NY, US")),
+             ("advice", click("Get Advice"))],
+    "Lab6a": [("load", load),
+              ("ask", type_text("Your question:", "What are the latest developments in AI regulation?")),
+              ("follow-up", type_text(None, "Give more detail on the second point.", key="followup_input"))],
+    "Lab6b": [("load", load),
+              ("recommend", click(" Get Recommendations")),
+              ("follow-up", type_text("Ask a follow-up question about these movies:", "Which is the shortest?"))],
+    "Lab8": [("load", load),
+             ("caption", caption_url)],
+    "Lab9": [("load", memory_profile),
+             ("chat", chat("Hi, I'm a data science major and I love hiking.")),
+             ("chat", chat("Write a Python function that reverses a string."))],
+}
+
+
+# Running sessions
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, in KB on Linux
+
+
+def app_error(at):
+    if at.exception:
+        return at.exception[0].message
+    if at.error:
+        return str(at.error[0].value)
+    return None
+
+
+def run_session(page, index, mock_url, timeout):
+    at = AppTest.from_file(os.path.join(ROOT, "Labs", f"{page}.py"), default_timeout=timeout)
+    steps = []
+    for name, step in SCENARIOS[page]:
+        start = time.perf_counter()
+        try:
+            step(at, index, mock_url)
+            error = app_error(at)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        steps.append({"step": name, "duration": time.perf_counter() - start, "error": error})
+        if error:
+            break  # later steps depend on this one
+    return steps
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def upstream_requests(mock):
+    return sum(s["requests"] for s in mock.stats().values())
+
+
+def run_page(page, sessions, concurrency, mock, timeout):
+    # One session runs alone first and measures the cold page load (imports,
+    # shared resources, script compilation); then the burst of concurrent
+    # sessions is measured on its own.
+    cold = run_session(page, 0, mock.url, timeout)
+    before = upstream_requests(mock)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"session-{page}") as pool:
+        futures = [pool.submit(run_session, page, i, mock.url, timeout) for i in range(1, sessions + 1)]
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+
+    steps = [s for session in results for s in session]
+    loads = [s["duration"] for s in steps if s["step"] == "load" and not s["error"]]
+    actions = [s["duration"] for s in steps if s["step"] != "load" and not s["error"]]
+    errors = [s["error"] for s in cold + steps if s["error"]]
+    completed = sum(1 for s in steps if not s["error"])
+    return {
+        "page": page,
+        "sessions": sessions,
+        "cold_load": cold[0]["duration"] if not cold[0]["error"] else None,
+        "steps": len(steps),
+        "errors": len(errors),
+        "error_rate": len(errors) / (len(cold) + len(steps)),
+        "first_error": errors[0] if errors else None,
+        "wall_s": round(wall, 3),
+        "throughput": round(completed / wall, 2) if wall else None,
+        "load_p50": percentile(loads, 0.5),
+        "load_p95": percentile(loads, 0.95),
+        "p50": percentile(actions, 0.5),
+        "p95": percentile(actions, 0.95),
+        "upstream": upstream_requests(mock) - before,
+        "rss_mb": round(rss_mb(), 1),
+    }
+
+
+def share_server_state():
+    # AppTest gives every run its own mock Runtime and script cache and clears the
+    # Runtime when the run ends, which breaks sessions running at the same time.
+    # A real server has one of each per process, so the harness shares them.
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+        if not last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last[0]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last))
+
+    shared = ScriptCache()
+    get_bytecode = ScriptCache.get_bytecode
+    ScriptCache.get_bytecode = lambda self, script_path: get_bytecode(shared, script_path)
+
+
+def prepare_workdir():
+    # Run in a scratch directory so the pages' SQLite files and the gateway store
+    # do not touch the developer's own, with mock keys in its secrets.toml
+    workdir = tempfile.mkdtemp(prefix="labs-loadtest-")
+    os.symlink(os.path.join(ROOT, "lab4pdfs"), os.path.join(workdir, "lab4pdfs"))
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+        f.writelines(f'{key} = "{value}"\n' for key, value in MOCK_SECRETS.items())
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    return workdir
+
+
+def configure_gateway(mock_url, cache):
+    # Read by llm_gateway when the first page imports it
+    os.environ["LLM_GATEWAY_UPSTREAM"] = mock_url
+    os.environ["LLM_GATEWAY_MODE"] = "live"
+    os.environ["LLM_GATEWAY_CACHE"] = "1" if cache else "0"
+    os.environ["LLM_GATEWAY_DIR"] = os.path.join(os.getcwd(), ".llm_gateway")
+    for name in ("OPENAI_BASE_URL", "ANTHROPIC_BASE_URL"):
+        os.environ.pop(name, None)  # SDKs must target the default hosts that get redirected
+
+
+def format_seconds(value):
+    return f"{value:7.2f}" if value is not None else f"{'-':>7}"
+
+
+def print_report(rows, mock):
+    print(f"{'page':<6} {'sess':>5} {'cold':>7} {'steps':>6} {'err':>4} {'ops/s':>7} {'load50':>7} {'load95':>7} "
+          f"{'p50':>7} {'p95':>7} {'upstrm':>7} {'rss MB':>7}")
+    for r in rows:
+        print(f"{r['page']:<6} {r['sessions']:>5} {format_seconds(r['cold_load'])} {r['steps']:>6} {r['errors']:>4} {r['throughput']:>7} "
+              f"{format_seconds(r['load_p50'])} {format_seconds(r['load_p95'])} "
+              f"{format_seconds(r['p50'])} {format_seconds(r['p95'])} {r['upstream']:>7} {r['rss_mb']:>7}")
+    for r in rows:
+        if r["first_error"]:
+            print(f"{r['page']}: first error: {r['first_error']}")
+    print("mock:", json.dumps(mock.stats()))
+
+
+def check_gates(rows, max_p95, max_error_rate):
+    failures = []
+    for r in rows:
+        if max_p95 is not None and r["p95"] is not None and r["p95"] > max_p95:
+            failures.append(f"{r['page']}: p95 {r['p95']:.2f}s > {max_p95}s")
+        if max_error_rate is not None and r["error_rate"] > max_error_rate:
+            failures.append(f"{r['page']}: error rate {r['error_rate']:.1%} > {max_error_rate:.1%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="+", default=PAGES, choices=PAGES)
+    parser.add_argument("--sessions", type=int, default=50, help="simulated sessions per page")
+    parser.add_argument("--concurrency", type=int, help="sessions running at once (default: all)")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds before headers")
+    parser.add_argument("--stream-rate", type=float, default=50.0, help="mock streamed tokens per second")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of mock requests answered 429")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per script run")
+    parser.add_argument("--cache", action="store_true", help="turn on the gateway's disk cache")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-p95", type=float, help="fail if any page's interaction p95 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, help="fail if any page's error rate exceeds this")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    prepare_workdir()
+    share_server_state()
+    # The harness threads drive AppTest from outside any script run
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: "missing ScriptRunContext" not in record.getMessage())
+    mock = MockServer(latency=args.latency, stream_rate=args.stream_rate, rate_limit=args.rate_limit,
+                      reply_tokens=args.reply_tokens).start()
+    configure_gateway(mock.url, args.cache)
+
+    rows = []
+    try:
+        for page in args.pages:
+            rows.append(run_page(page, args.sessions, args.concurrency or args.sessions, mock, args.timeout))
+    finally:
+        mock.stop()
+
+    print_report(rows, mock)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"args": vars(args), "pages": rows, "mock": mock.stats()}, f, indent=2)
+
+    failures = check_gates(rows, args.max_p95, args.max_error_rate)
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
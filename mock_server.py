@@ -0,0 +1,445 @@
+"""Local stand-in for every API the Labs call, used by loadtest.py.
+
+Serves the OpenAI chat completions, embeddings, responses and models
+endpoints, the Anthropic messages endpoint, the OpenWeatherMap current
+weather endpoint and a test image, all with canned but well-formed payloads.
+Streaming endpoints emit server-sent events at a fixed token rate.
+
+Point the app at it through the gateway:
+
+    python mock_server.py --port 8765 --latency 0.3 --stream-rate 50 --rate-limit 0.05
+    LLM_GATEWAY_UPSTREAM=http://127.0.0.1:8765 streamlit run streamlit_app.py
+
+Behaviour knobs:
+
+- latency: seconds before the response headers are sent,
+- stream_rate: tokens per second for streamed replies (0 sends them at once),
+- rate_limit: fraction of requests answered with 429 and a Retry-After header,
+- reply_tokens: words per generated reply.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    "the course covers data pipelines retrieval models evaluation and weekly labs "
+    "students should wear layers today because the afternoon turns cool and windy "
+    "this film pairs a quiet mood with sharp dialogue and a memorable final act"
+).split()
+EMBEDDING_DIM = 1536
+
+
+def png_bytes(width=64, height=64, rgb=(70, 130, 180)):
+    # A solid-colour PNG, so the mock needs no imaging library
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+def fake_embedding(text, dim):
+    # Deterministic unit vector per text, so identical inputs embed identically
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+def sample_for_schema(schema, words):
+    # A value that satisfies a (simple) JSON schema, for structured outputs
+    kind = schema.get("type")
+    if kind == "object":
+        return {k: sample_for_schema(v, words) for k, v in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_for_schema(schema.get("items", {"type": "string"}), words) for _ in range(3)]
+    if kind in ("integer", "number"):
+        return 1
+    if kind == "boolean":
+        return True
+    return " ".join(words)
+
+
+def prompt_text(body):
+    # All text the caller sent, used to pick a reply shape
+    parts = []
+
+    def walk(value):
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+        elif isinstance(value, dict):
+            for key in ("content", "text", "input", "system", "instructions"):
+                walk(value.get(key))
+
+    walk(body.get("messages"))
+    walk(body.get("input"))
+    walk(body.get("system"))
+    walk(body.get("instructions"))
+    return "\n".join(parts)
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that stop reading a stream early are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, stream_rate=50.0,
+                 rate_limit=0.0, reply_tokens=60, retry_after=0.5, seed=0):
+        self.latency = latency
+        self.stream_rate = stream_rate
+        self.rate_limit = rate_limit
+        self.reply_tokens = reply_tokens
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}  # endpoint -> [requests, 429s]
+        self.response_ids = set()  # Responses API ids issued, for previous_response_id
+        self.httpd = MockHTTPServer((host, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {endpoint: {"requests": n, "rate_limited": limited}
+                    for endpoint, (n, limited) in sorted(self.counts.items())}
+
+    def admit(self, endpoint):
+        # Count the request; True if it should be answered with 429
+        with self.lock:
+            counts = self.counts.setdefault(endpoint, [0, 0])
+            counts[0] += 1
+            limited = self.random.random() < self.rate_limit
+            counts[1] += limited
+        return limited
+
+    def reply_words(self, seed_text):
+        rng = random.Random(seed_text)
+        return [rng.choice(WORDS) for _ in range(self.reply_tokens)]
+
+    def handler_class(self):
+        server = self
+
+        class Handler(MockHandler):
+            mock = server
+
+        return Handler
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    mock: MockServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    # Routing
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        routes = {
+            "/v1/models": self.models,
+            "/data/2.5/weather": self.weather,
+            "/image.png": self.image,
+        }
+        self.dispatch(routes, path, None)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        routes = {
+            "/v1/chat/completions": self.chat_completions,
+            "/v1/embeddings": self.embeddings,
+            "/v1/responses": self.openai_responses,
+            "/v1/messages": self.anthropic_messages,
+        }
+        self.dispatch(routes, path, body)
+
+    def dispatch(self, routes, path, body):
+        route = routes.get(path)
+        if route is None:
+            self.send_json({"error": {"message": f"no mock for {path}"}}, status=404)
+            return
+        time.sleep(self.mock.latency)
+        if self.mock.admit(path):
+            self.send_json({"error": {"type": "rate_limit_error", "message": "mock rate limit"}},
+                           status=429, headers={"Retry-After": str(self.mock.retry_after)})
+            return
+        if body is None:
+            route()
+        else:
+            route(body)
+
+    # Response helpers
+
+    def send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_event(self, payload, event=None):
+        data = (f"event: {event}\n" if event else "") + f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n"
+        raw = data.encode()
+        self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+        self.wfile.flush()
+
+    def end_events(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def pace(self):
+        if self.mock.stream_rate > 0:
+            time.sleep(1 / self.mock.stream_rate)
+
+    # OpenAI
+
+    def models(self):
+        self.send_json({"object": "list", "data": [
+            {"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "mock"},
+        ]})
+
+    def chat_completions(self, body):
+        model = body.get("model", "gpt-4o-mini")
+        text = prompt_text(body)
+        words = self.mock.reply_words(text)
+        usage = {"prompt_tokens": len(text.split()), "completion_tokens": len(words),
+                 "total_tokens": len(text.split()) + len(words)}
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": model}
+
+        # First turn of a tool-enabled conversation: ask for the first tool
+        messages = body.get("messages", [])
+        if body.get("tools") and not any(m.get("role") == "tool" for m in messages):
+            tool = body["tools"][0]["function"]
+            arguments = json.dumps({p: "Syracuse, NY, US" for p in tool.get("parameters", {}).get("required", [])})
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": "call_mock", "type": "function",
+                "function": {"name": tool["name"], "arguments": arguments},
+            }]}
+            self.send_json({**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": message, "finish_reason": "tool_calls"}]})
+            return
+
+        if not body.get("stream"):
+            self.send_json({**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                 "finish_reason": "stop"}]})
+            return
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        self.start_events()
+        self.send_event({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                               "finish_reason": None}]})
+        for i, word in enumerate(words):
+            self.pace()
+            self.send_event({**chunk, "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word},
+                                                   "finish_reason": None}]})
+        self.send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.send_event({**chunk, "choices": [], "usage": usage})
+        self.send_event("[DONE]")
+        self.end_events()
+
+    def embeddings(self, body):
+        inputs = body.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dim = body.get("dimensions") or EMBEDDING_DIM
+        tokens = sum(len(str(text).split()) for text in inputs)
+        self.send_json({
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dim)}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def openai_responses(self, body):
+        previous_id = body.get("previous_response_id")
+        with self.mock.lock:
+            known = previous_id is None or previous_id in self.mock.response_ids
+        if not known:
+            self.send_json({"error": {"type": "invalid_request_error", "param": "previous_response_id",
+                                      "message": f"Previous response with id '{previous_id}' not found."}},
+                           status=400)
+            return
+        model = body.get("model", "gpt-4o-mini")
+        text = prompt_text(body)
+        words = self.mock.reply_words(text)
+        fmt = (body.get("text") or {}).get("format") or {}
+        if fmt.get("type") == "json_schema":
+            output = json.dumps(sample_for_schema(fmt.get("schema", {}), words[:12]))
+            deltas = [output[i:i + 8] for i in range(0, len(output), 8)]
+        else:
+            output = " ".join(words)
+            deltas = [(" " if i else "") + w for i, w in enumerate(words)]
+
+        response_id = "resp_" + hashlib.sha1(f"{text}{time.time()}".encode()).hexdigest()[:24]
+        with self.mock.lock:
+            self.mock.response_ids.add(response_id)
+        part = {"type": "output_text", "text": output, "annotations": []}
+        item = {"type": "message", "id": "msg_mock", "status": "completed", "role": "assistant",
+                "content": [part]}
+        usage = {"input_tokens": len(text.split()), "output_tokens": len(words),
+                 "total_tokens": len(text.split()) + len(words),
+                 "input_tokens_details": {"cached_tokens": 0},
+                 "output_tokens_details": {"reasoning_tokens": 0}}
+        response = {"id": response_id, "object": "response", "created_at": int(time.time()),
+                    "status": "completed", "model": model, "output": [item], "usage": usage,
+                    "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                    "previous_response_id": body.get("previous_response_id"),
+                    "text": body.get("text") or {"format": {"type": "text"}}}
+        if not body.get("stream"):
+            self.send_json(response)
+            return
+
+        seq = iter(range(1_000_000))
+        pending = {**response, "status": "in_progress", "output": [], "usage": None}
+        self.start_events()
+        events = [
+            ("response.created", {"response": pending}),
+            ("response.output_item.added", {"output_index": 0, "item": {**item, "status": "in_progress", "content": []}}),
+            ("response.content_part.added", {"item_id": "msg_mock", "output_index": 0, "content_index": 0,
+                                             "part": {**part, "text": ""}}),
+        ]
+        for name, payload in events:
+            self.send_event({"type": name, "sequence_number": next(seq), **payload}, event=name)
+        for delta in deltas:
+            self.pace()
+            self.send_event({"type": "response.output_text.delta", "sequence_number": next(seq),
+                             "item_id": "msg_mock", "output_index": 0, "content_index": 0,
+                             "delta": delta, "logprobs": []}, event="response.output_text.delta")
+        events = [
+            ("response.output_text.done", {"item_id": "msg_mock", "output_index": 0, "content_index": 0,
+                                           "text": output, "logprobs": []}),
+            ("response.content_part.done", {"item_id": "msg_mock", "output_index": 0, "content_index": 0,
+                                            "part": part}),
+            ("response.output_item.done", {"output_index": 0, "item": item}),
+            ("response.completed", {"response": response}),
+        ]
+        for name, payload in events:
+            self.send_event({"type": name, "sequence_number": next(seq), **payload}, event=name)
+        self.end_events()
+
+    # Anthropic
+
+    def anthropic_messages(self, body):
+        model = body.get("model", "claude-haiku-4-5-20251001")
+        text = prompt_text(body)
+        words = self.mock.reply_words(text)
+        if "JSON array" in text:  # memory extraction and compaction prompts
+            output = json.dumps([f"User mentioned {w}" for w in words[:2]])
+            deltas = [output]
+        else:
+            output = " ".join(words)
+            deltas = [(" " if i else "") + w for i, w in enumerate(words)]
+        usage = {"input_tokens": len(text.split()), "output_tokens": len(words),
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        message = {"id": "msg_mock", "type": "message", "role": "assistant", "model": model,
+                   "content": [{"type": "text", "text": output}], "stop_reason": "end_turn",
+                   "stop_sequence": None, "usage": usage}
+        if not body.get("stream"):
+            self.send_json(message)
+            return
+
+        self.start_events()
+        self.send_event({"type": "message_start", "message": {**message, "content": [], "stop_reason": None,
+                                                              "usage": {**usage, "output_tokens": 1}}},
+                        event="message_start")
+        self.send_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                        event="content_block_start")
+        for delta in deltas:
+            self.pace()
+            self.send_event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": delta}},
+                            event="content_block_delta")
+        self.send_event({"type": "content_block_stop", "index": 0}, event="content_block_stop")
+        self.send_event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                         "usage": {"output_tokens": len(words)}}, event="message_delta")
+        self.send_event({"type": "message_stop"}, event="message_stop")
+        self.end_events()
+
+    # OpenWeatherMap and images
+
+    def weather(self):
+        city = parse_qs(urlsplit(self.path).query).get("q", ["Syracuse"])[0]
+        self.send_json({
+            "name": city.split(",")[0],
+            "main": {"temp": 54.3, "feels_like": 51.8, "temp_min": 50.0, "temp_max": 58.1, "humidity": 71},
+            "weather": [{"main": "Clouds", "description": "broken clouds"}],
+            "wind": {"speed": 9.2},
+        })
+
+    def image(self):
+        data = png_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before headers")
+    parser.add_argument("--stream-rate", type=float, default=50.0, help="streamed tokens per second")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, latency=args.latency, stream_rate=args.stream_rate,
+                        rate_limit=args.rate_limit, reply_tokens=args.reply_tokens)
+    print(f"Mock APIs on {server.url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Process-wide course-syllabus index used by Lab 4.
+
+The index is built once per process, either by the first Lab 4 visit or by the
+background warm-up in warmup.py, and then shared by every session. chromadb and
+PyPDF2 are imported only when the index is first built.
+
+Every document, the syllabi included, enters the index through ingest_pdf(),
+which streams a PDF page by page through extraction, chunking and batched
+embedding and appends each batch to the live collection, so adding a file
+costs only that file. Chunks record the SHA-256 of their file and a scope:
+"shared" chunks are retrieved for everyone, "session:<id>" chunks only for the
+session that uploaded them. A session scope that has not been used for
+SESSION_SCOPE_TTL is deleted from the index.
+"""
+
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+
+import scheduler
+import telemetry
+
+PDF_DIR = "./lab4pdfs"
+COLLECTION_NAME = "Lab4Collection_v2"
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_BATCH_SIZE = 100
+SHARED_SCOPE = "shared"
+SESSION_SCOPE_TTL = 60 * 60  # seconds a session's private uploads outlive its last visit
+SCOPE_SWEEP_INTERVAL = 5 * 60  # seconds between sweeps for expired session scopes
+
+_lock = threading.Lock()
+_index = None
+_ingest_locks = {}  # content hash -> lock held while that file is ingested
+_ingest_locks_lock = threading.Lock()
+_scopes = {}  # session scope with private chunks -> last time its session used the index
+_scopes_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def import_chromadb():
+    # chromadb needs a newer sqlite than some hosts ship, so pysqlite3 is swapped
+    # in as sqlite3 before chromadb is imported for the first time
+    if "chromadb" not in sys.modules and "pysqlite3" not in sys.modules:
+        __import__("pysqlite3")
+        sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+    import chromadb
+
+    return chromadb
+
+
+def session_scope(session_key):
+    return f"session:{session_key}"
+
+
+def visible_to(session_key):
+    # Chroma where-filter for the chunks a session may retrieve
+    return {"scope": {"$in": [SHARED_SCOPE, session_scope(session_key)]}}
+
+
+def touch_scope(session_key):
+    # Marks the session's private uploads as in use and sweeps expired scopes.
+    # Returns False if the session has no private uploads in the index (any it
+    # had have expired).
+    scope = session_scope(session_key)
+    with _scopes_lock:
+        live = scope in _scopes
+        if live:
+            _scopes[scope] = time.monotonic()
+    expire_scopes()
+    return live
+
+
+def expire_scopes():
+    # Deletes the chunks of session scopes unused for SESSION_SCOPE_TTL, at most
+    # once per SCOPE_SWEEP_INTERVAL
+    global _last_sweep
+    now = time.monotonic()
+    with _scopes_lock:
+        if _index is None or (_last_sweep and now - _last_sweep < SCOPE_SWEEP_INTERVAL):
+            return
+        _last_sweep = now
+        expired = [scope for scope, seen in _scopes.items() if now - seen > SESSION_SCOPE_TTL]
+        for scope in expired:
+            del _scopes[scope]
+    if expired:
+        _index.delete(where={"scope": {"$in": expired}})
+
+
+# Helper functions for chunking text
+def iter_chunks(texts, chunk_size=1000, overlap=200):
+    # Chunks of the concatenation of texts, yielded as the texts arrive; the same
+    # chunks chunk_text("".join(texts)) returns
+    step = chunk_size - overlap
+    buffer = ""
+    for text in texts:
+        buffer += text
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+    start = 0
+    while start < len(buffer):
+        yield buffer[start:start + chunk_size]
+        start += step
+
+
+def chunk_text(text, chunk_size=1000, overlap=200):
+    return list(iter_chunks([text], chunk_size, overlap))
+
+
+def embed(client, documents):
+    # Ingestion queues behind interactive chat in the scheduler
+    with scheduler.priority(scheduler.BACKGROUND):
+        response = client.embeddings.create(input=documents, model=EMBED_MODEL)
+    return [data.embedding for data in response.data]
+
+
+def ingest_lock(content_hash):
+    with _ingest_locks_lock:
+        return _ingest_locks.setdefault(content_hash, threading.Lock())
+
+
+def chunk_ids(content_hash, scope, first, count):
+    return [f"{content_hash[:16]}:{scope}:{first + i}" for i in range(count)]
+
+
+def ingest_pdf(client, collection, data, filename, scope=SHARED_SCOPE, on_progress=None):
+    # Adds one PDF, given as bytes, to the collection and returns (status, chunks).
+    # status is "added", "copied" when the same file was already embedded for
+    # another scope and its vectors are reused, or "duplicate" when the file is
+    # already visible in this scope. Only uploads of the same file wait for each
+    # other; queries and other uploads use the collection meanwhile.
+    import PyPDF2
+
+    on_progress = on_progress or (lambda fraction, text: None)
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    if scope != SHARED_SCOPE:
+        with _scopes_lock:
+            _scopes[scope] = time.monotonic()
+
+    with ingest_lock(content_hash):
+        existing = collection.get(where={"content_hash": content_hash},
+                                  include=["documents", "metadatas", "embeddings"])
+        scopes = {meta["scope"] for meta in existing["metadatas"]}
+        if SHARED_SCOPE in scopes or scope in scopes:
+            visible = scope if scope in scopes else SHARED_SCOPE
+            return "duplicate", sum(meta["scope"] == visible for meta in existing["metadatas"])
+
+        if scopes:
+            source = next(iter(scopes))
+            rows = sorted(
+                (meta["chunk_id"], document, vector)
+                for document, meta, vector in zip(existing["documents"], existing["metadatas"], existing["embeddings"])
+                if meta["scope"] == source
+            )
+            collection.add(
+                documents=[document for _, document, _ in rows],
+                embeddings=[list(vector) for _, _, vector in rows],
+                metadatas=[{"filename": filename, "chunk_id": i, "content_hash": content_hash, "scope": scope}
+                           for i, _, _ in rows],
+                ids=chunk_ids(content_hash, scope, 0, len(rows)),
+            )
+            status, count = "copied", len(rows)
+            on_progress(1.0, f"Indexed {count} chunks of {filename}")
+        else:
+            reader = PyPDF2.PdfReader(io.BytesIO(data))
+            page_count = len(reader.pages)
+            pages_read = 0
+            extract_seconds = 0.0
+
+            def pages():
+                nonlocal pages_read, extract_seconds
+                for page in reader.pages:
+                    start = time.perf_counter()
+                    text = page.extract_text() or ""
+                    extract_seconds += time.perf_counter() - start
+                    pages_read += 1
+                    yield text
+
+            def append(batch, first):
+                # Each batch is searchable as soon as it is added, and progress is
+                # only reported once it has been
+                collection.add(
+                    documents=batch,
+                    embeddings=embed(client, batch),
+                    metadatas=[{"filename": filename, "chunk_id": first + i, "content_hash": content_hash,
+                                "scope": scope} for i in range(len(batch))],
+                    ids=chunk_ids(content_hash, scope, first, len(batch)),
+                )
+                stored = first + len(batch)
+                on_progress(pages_read / page_count if page_count else 1.0,
+                            f"Indexed {stored} chunks from {pages_read}/{page_count} pages of {filename}")
+
+            count, batch = 0, []
+            try:
+                for chunk in iter_chunks(pages()):
+                    batch.append(chunk)
+                    if len(batch) == EMBED_BATCH_SIZE:
+                        append(batch, count)
+                        count, batch = count + len(batch), []
+                if batch:
+                    append(batch, count)
+                    count += len(batch)
+            except BaseException:
+                # A half-indexed file would be reported as a duplicate on the
+                # next upload, so the batches stored so far are removed
+                collection.delete(where={"$and": [{"content_hash": content_hash}, {"scope": scope}]})
+                raise
+            telemetry.record("pdf", "PyPDF2.extract_text", extract_seconds, file=filename, pages=page_count)
+            status = "added"
+
+        if scope == SHARED_SCOPE and scopes:
+            # Session copies of a file that is now shared would be retrieved twice
+            collection.delete(where={"$and": [{"content_hash": content_hash},
+                                              {"scope": {"$ne": SHARED_SCOPE}}]})
+    return status, count
+
+
+def build_index(client, on_progress=None, on_error=None):
+    # Returns the ChromaDB collection, or None if any file could not be indexed.
+    # on_progress(fraction, text) and on_error(message) let the page show status.
+    on_progress = on_progress or (lambda fraction, text: None)
+    on_error = on_error or (lambda message: None)
+
+    # Check if directory exists
+    if not os.path.exists(PDF_DIR):
+        on_error(f"Directory {PDF_DIR} not found.")
+        return None
+
+    # Retrieve all PDF files
+    pdf_files = [f for f in os.listdir(PDF_DIR) if f.endswith('.pdf')]
+
+    if not pdf_files:
+        on_error(f"No PDF files found in {PDF_DIR}.")
+        return None
+
+    chromadb = import_chromadb()
+    chroma_client = chromadb.Client()
+
+    try:
+        # Delete any older copy so the collection always matches the folder
+        chroma_client.delete_collection(name=COLLECTION_NAME)
+    except Exception:
+        pass
+
+    collection = chroma_client.create_collection(name=COLLECTION_NAME)
+
+    # The syllabi go through the same path as uploads, shared with everyone
+    complete = True
+    for n, filename in enumerate(pdf_files):
+        def file_progress(fraction, text, n=n):
+            on_progress((n + fraction) / len(pdf_files), text)
+
+        try:
+            with open(os.path.join(PDF_DIR, filename), 'rb') as f:
+                data = f.read()
+            ingest_pdf(client, collection, data, filename, SHARED_SCOPE, on_progress=file_progress)
+        except Exception as e:
+            on_error(f"Error indexing {filename}: {e}")
+            complete = False
+
+    # A partial index is not returned, so get_index does not keep it and the
+    # next caller builds it again
+    return collection if complete and collection.count() else None
+
+
+def get_index(client, on_progress=None, on_error=None):
+    # Build on first use; concurrent callers wait for the same build. A failed or
+    # partial build is not kept, so the next caller tries again.
+    global _index
+    with _lock:
+        if _index is None:
+            _index = build_index(client, on_progress, on_error)
+        return _index
+
+
+def is_ready():
+    return _index is not None
@@ -0,0 +1,287 @@
+"""Process-wide admission control for outbound API calls.
+
+llm_gateway asks for admission before every upstream request to a known
+provider. Each provider has token buckets for requests per minute and tokens
+per minute, and a cap on requests in flight. Waiting requests are admitted
+interactive before background, and round-robin across sessions within a
+priority, so one session's burst or a warm-up cannot starve everyone else.
+When a provider answers 429, the whole provider pauses for the Retry-After
+delay instead of every session retrying on its own.
+
+Requests made from a page's script thread are interactive. Requests from other
+threads (memory extraction, warm-ups, batch workers) are background, and code
+can choose explicitly with ``with scheduler.priority(scheduler.BACKGROUND):``.
+Worker threads doing a session's work take their turn as that session when run
+in a context copied inside ``with scheduler.session(scheduler.current_session()):``.
+
+Limits come from environment variables, per provider (OPENAI, ANTHROPIC,
+OPENWEATHERMAP):
+
+    SCHEDULER_<PROVIDER>_RPM          requests per minute
+    SCHEDULER_<PROVIDER>_TPM          tokens per minute, 0 for no limit
+    SCHEDULER_<PROVIDER>_CONCURRENCY  requests in flight
+
+SCHEDULER_ENABLED=0 turns admission control off.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import telemetry
+
+ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") not in ("0", "false", "no")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)  # admitted in this order
+
+PROVIDER_HOSTS = {
+    "api.openai.com": "openai",
+    "api.anthropic.com": "anthropic",
+    "api.openweathermap.org": "openweathermap",
+}
+# (requests/min, tokens/min, in flight) when no environment variable is set
+DEFAULT_LIMITS = {
+    "openai": (500, 200_000, 32),
+    "anthropic": (50, 40_000, 16),
+    "openweathermap": (60, 0, 8),
+}
+DEFAULT_OUTPUT_TOKENS = 512  # assumed reply size when a request sets no maximum
+# Prompt tokens charged per image part by its detail level; an image's base64
+# data is not counted as text. Anthropic images have no detail and count as auto.
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+IMAGE_PART_TYPES = {"image_url", "input_image", "image"}
+LEASE_SECONDS = 600.0  # a slot whose response is never finished is reclaimed after this
+MAX_POLL_SECONDS = 1.0
+
+_priority = contextvars.ContextVar("scheduler_priority", default=None)
+_session = contextvars.ContextVar("scheduler_session", default=None)
+_lock = threading.Lock()
+_providers = {}
+
+
+@contextmanager
+def priority(name):
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    explicit = _priority.get()
+    if explicit is not None:
+        return explicit
+    return INTERACTIVE if get_script_run_ctx(suppress_warning=True) is not None else BACKGROUND
+
+
+@contextmanager
+def session(session_id):
+    token = _session.set(session_id)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def current_session():
+    explicit = _session.get()
+    if explicit is not None:
+        return explicit
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else f"thread:{threading.current_thread().name}"
+
+
+def image_parts(value):
+    # (characters of JSON, tokens) taken up by the image parts nested in value
+    if isinstance(value, list):
+        sizes = [image_parts(v) for v in value]
+        return sum(c for c, _ in sizes), sum(t for _, t in sizes)
+    if not isinstance(value, dict):
+        return 0, 0
+    if value.get("type") in IMAGE_PART_TYPES:
+        image = value.get("image_url")
+        detail = value.get("detail") or (image.get("detail") if isinstance(image, dict) else None)
+        return len(json.dumps(value)), IMAGE_TOKENS.get(detail, IMAGE_TOKENS["auto"])
+    return image_parts(list(value.values()))
+
+
+def estimate_tokens(path, body):
+    # Prompt tokens from the body size, with images at their fixed cost, plus the
+    # most the reply may use
+    if not body:
+        return 0
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return len(body) // 4
+    image_chars, image_tokens = image_parts(data)
+    tokens = max(len(body) - image_chars, 0) // 4 + image_tokens
+    if path.endswith("/embeddings") or not isinstance(data, dict):
+        return tokens
+    for field in ("max_tokens", "max_output_tokens", "max_completion_tokens"):
+        if isinstance(data.get(field), int):
+            return tokens + data[field]
+    return tokens + DEFAULT_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until amount can be taken; larger amounts wait for a full bucket
+        if self.capacity <= 0:
+            return 0.0
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.capacity > 0:
+            self.level -= amount  # may go negative when a request used more than estimated
+
+
+class Waiter:
+    def __init__(self, tokens, priority, session):
+        self.tokens, self.priority, self.session = tokens, priority, session
+        self.event = threading.Event()
+        self.enqueued = time.monotonic()
+        self.ticket = None
+
+
+class Provider:
+    def __init__(self, name):
+        rpm, tpm, concurrency = DEFAULT_LIMITS[name]
+        prefix = f"SCHEDULER_{name.upper()}_"
+        self.name = name
+        self.requests = TokenBucket(int(os.environ.get(prefix + "RPM", rpm)))
+        self.tokens = TokenBucket(int(os.environ.get(prefix + "TPM", tpm)))
+        self.concurrency = int(os.environ.get(prefix + "CONCURRENCY", concurrency))
+        self.in_flight = {}  # Ticket -> admission time
+        self.paused_until = 0.0
+        self.queues = {p: OrderedDict() for p in PRIORITIES}  # session -> deque of Waiters
+
+    def enqueue(self, waiter):
+        self.queues[waiter.priority].setdefault(waiter.session, deque()).append(waiter)
+
+    def head(self):
+        # The next waiter: highest priority first, then the session at the front
+        # of that priority's round-robin order
+        for p in PRIORITIES:
+            if self.queues[p]:
+                return next(iter(self.queues[p].values()))[0]
+        return None
+
+    def pop(self, waiter):
+        queue = self.queues[waiter.priority]
+        waiters = queue[waiter.session]
+        waiters.popleft()
+        if waiters:
+            queue.move_to_end(waiter.session)
+        else:
+            del queue[waiter.session]
+
+    def dispatch(self, now):
+        # Admits waiters while capacity allows. Returns how long until the head of
+        # the queue could be admitted, or None if it waits for a slot to free up.
+        for ticket, since in list(self.in_flight.items()):
+            if now - since > LEASE_SECONDS:
+                del self.in_flight[ticket]
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while (waiter := self.head()) is not None:
+            if len(self.in_flight) >= self.concurrency:
+                return None
+            delay = max(self.paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if delay > 0:
+                return delay
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.pop(waiter)
+            waiter.ticket = Ticket(self, waiter.tokens, now - waiter.enqueued)
+            self.in_flight[waiter.ticket] = now
+            waiter.event.set()
+            telemetry.observe("llm_scheduler_wait_seconds", now - waiter.enqueued,
+                              provider=self.name, priority=waiter.priority)
+        return None
+
+    def report(self):
+        for p in PRIORITIES:
+            depth = sum(len(waiters) for waiters in self.queues[p].values())
+            telemetry.set_gauge("llm_scheduler_queue_depth", depth, provider=self.name, priority=p)
+        telemetry.set_gauge("llm_scheduler_in_flight", len(self.in_flight), provider=self.name)
+
+
+class Ticket:
+    # An admitted request. The gateway retries, pauses the provider, settles the
+    # token estimate and releases the slot through it. Requests to hosts that are
+    # not scheduled get a ticket without a provider, on which all of these are no-ops.
+    def __init__(self, provider=None, tokens=0, waited=0.0):
+        self.provider, self.tokens, self.waited = provider, tokens, waited
+        self.settled = self.released = provider is None
+
+    def retry(self):
+        # A retry keeps its slot but needs another request from the bucket
+        while self.provider is not None:
+            with _lock:
+                now = time.monotonic()
+                self.provider.requests.refill(now)
+                delay = max(self.provider.paused_until - now, self.provider.requests.wait_time(1))
+                if delay <= 0:
+                    self.provider.requests.take(1)
+                    return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        if self.provider is None:
+            return
+        with _lock:
+            self.provider.paused_until = max(self.provider.paused_until, time.monotonic() + seconds)
+
+    def settle(self, actual_tokens):
+        with _lock:
+            if not self.settled:
+                self.settled = True
+                self.provider.tokens.take(actual_tokens - self.tokens)
+
+    def release(self):
+        with _lock:
+            if self.released:
+                return
+            self.released = True
+            self.provider.in_flight.pop(self, None)
+            self.provider.dispatch(time.monotonic())
+            self.provider.report()
+
+
+def admit(host, path, body, priority=None, session=None):
+    # Blocks until the request may be sent and returns its Ticket
+    name = PROVIDER_HOSTS.get(host)
+    if not ENABLED or name is None:
+        return Ticket()
+    waiter = Waiter(estimate_tokens(path, body), priority or current_priority(), session or current_session())
+    with _lock:
+        provider = _providers.get(name) or _providers.setdefault(name, Provider(name))
+        provider.enqueue(waiter)
+        delay = provider.dispatch(time.monotonic())
+        provider.report()
+    while not waiter.event.wait(min(delay or MAX_POLL_SECONDS, MAX_POLL_SECONDS)):
+        with _lock:
+            delay = provider.dispatch(time.monotonic())
+            provider.report()
+    return waiter.ticket
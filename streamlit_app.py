@@ -1,4 +1,6 @@
 import streamlit as st
+import telemetry
+import warmup
 
 # Pages
 lab1 = st.Page("Labs/Lab1.py", title= "Lab 1 - Document Q & A", icon = ":material/description:")
@@ -17,4 +19,15 @@ pg = st.navigation([lab1, lab2, lab3, lab4, lab5, lab6a, lab6b, lab8, lab9])
 # Configuration
 st.set_page_config(page_title="IST 488 Labs", page_icon=":material/school:")
 
-pg.run()
\ No newline at end of file
+# Telemetry: tag spans with the current page and serve /metrics if configured
+telemetry.start_metrics_server()
+telemetry.set_page(pg.title)
+
+# The page may end its run early with st.stop() or st.rerun(), which raise, so
+# the warm-up and the metrics panel run in finally
+try:
+    pg.run()
+finally:
+    # Load the other pages' heavy modules in the background once this page is drawn
+    warmup.start()
+    telemetry.sidebar_panel()
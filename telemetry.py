@@ -0,0 +1,271 @@
+"""Latency and token telemetry shared by every page.
+
+Spans are recorded for model, embedding, retrieval, PDF extraction and tool
+calls. Model, embedding and weather spans come from llm_gateway, which sees all
+API traffic. Each span carries its duration, time to first byte for streamed
+responses, and token usage. Spans feed:
+
+- a per-session list shown by sidebar_panel(),
+- process-wide latency histograms, token/cost counters (cached and coalesced
+  responses are counted as saved cost, not cost) and the scheduler's
+  queue gauges, served in the Prometheus text format on
+  http://localhost:$TELEMETRY_PORT/metrics when that variable is set,
+- an optional JSONL log of every span at $TELEMETRY_JSONL.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+SESSION_SPAN_LIMIT = 200
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+JSONL_PATH = os.environ.get("TELEMETRY_JSONL")
+METRICS_PORT = os.environ.get("TELEMETRY_PORT")
+
+# Estimated USD per million (input, output) tokens, used for the cost columns
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-5-nano": (0.05, 0.40),
+    "text-embedding-3-small": (0.02, 0.0),
+    "claude-opus-4-5": (5.00, 25.00),
+    "claude-haiku-4-5-20251001": (1.00, 5.00),
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (metric, labels) -> value
+_gauges = {}      # (metric, labels) -> value
+_origin = contextvars.ContextVar("telemetry_origin", default=None)  # (page, session span list)
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    price_in, price_out = PRICES.get(model or "", (0.0, 0.0))
+    return ((input_tokens or 0) * price_in + (output_tokens or 0) * price_out) / 1_000_000
+
+
+def current_page():
+    if get_script_run_ctx(suppress_warning=True) is None:
+        origin = _origin.get()
+        return origin[0] if origin else "background"
+    return st.session_state.get("telemetry_page", "unknown")
+
+
+def session_spans():
+    # The list shown by sidebar_panel(), or None outside a session
+    if get_script_run_ctx(suppress_warning=True) is None:
+        origin = _origin.get()
+        return origin[1] if origin else None
+    return st.session_state.setdefault("telemetry_spans", [])
+
+
+@contextmanager
+def carry():
+    # Spans from worker threads started in this block are charged to the current
+    # page and session. Workers must run in a copy of this context, e.g.
+    # pool.submit(contextvars.copy_context().run, fn, ...).
+    token = _origin.set((current_page(), session_spans()))
+    try:
+        yield
+    finally:
+        _origin.reset(token)
+
+
+def set_page(title):
+    st.session_state.telemetry_page = title
+
+
+def _observe(metric, labels, value):
+    key = (metric, labels)
+    series = _histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            series[i] += 1
+    series[-2] += 1
+    series[-1] += value
+
+
+def _add(metric, labels, value):
+    _counters[(metric, labels)] = _counters.get((metric, labels), 0) + value
+
+
+def observe(metric, value, **labels):
+    with _lock:
+        _observe(metric, tuple(labels.items()), value)
+
+
+def set_gauge(metric, value, **labels):
+    with _lock:
+        _gauges[(metric, tuple(labels.items()))] = value
+
+
+def record(kind, name, duration, *, ttft=None, model=None, input_tokens=None,
+           output_tokens=None, cached=False, coalesced=False, error=None, **attrs):
+    page = current_page()
+    span = {
+        "ts": time.time(),
+        "page": page,
+        "kind": kind,
+        "name": name,
+        "model": model,
+        "duration": round(duration, 4),
+        "ttft": round(ttft, 4) if ttft is not None else None,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        # Cached and coalesced responses cost nothing; what they would have cost is saved
+        "cost": 0.0 if cached or coalesced else estimate_cost(model, input_tokens, output_tokens),
+        "saved": estimate_cost(model, input_tokens, output_tokens) if cached or coalesced else 0.0,
+        "cached": cached,
+        "coalesced": coalesced,
+        "error": error,
+        **attrs,
+    }
+    if output_tokens and ttft is not None and duration > ttft:
+        span["tokens_per_s"] = round(output_tokens / (duration - ttft), 1)
+
+    labels = (("page", page), ("kind", kind), ("name", name))
+    with _lock:
+        _observe("llm_span_duration_seconds", labels, duration)
+        if ttft is not None:
+            _observe("llm_time_to_first_byte_seconds", labels, ttft)
+        _add("llm_spans_total", labels + (("error", str(bool(error)).lower()),), 1)
+        if coalesced:
+            _add("llm_coalesced_requests_total", labels, 1)
+        model_labels = (("page", page), ("model", model or ""))
+        _add("llm_input_tokens_total", model_labels, input_tokens or 0)
+        _add("llm_output_tokens_total", model_labels, output_tokens or 0)
+        _add("llm_cost_usd_total", model_labels, span["cost"])
+        _add("llm_saved_cost_usd_total", model_labels, span["saved"])
+        if JSONL_PATH:
+            with open(JSONL_PATH, "a") as f:
+                f.write(json.dumps(span) + "\n")
+
+        spans = session_spans()
+        if spans is not None:
+            spans.append(span)
+            del spans[:-SESSION_SPAN_LIMIT]
+    return span
+
+
+@contextmanager
+def span(kind, name, **attrs):
+    # Times the block; the caller can add attributes (e.g. results=5) to the dict
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(kind, name, time.perf_counter() - start, error=error, **attrs)
+
+
+# Prometheus text export
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{k}="{v}"' for k, v in labels + tuple(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    for metric in sorted({m for m, _ in histograms}):
+        lines.append(f"# TYPE {metric} histogram")
+        for (m, labels), series in histograms.items():
+            if m != metric:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, series):
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-2]}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {series[-2]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {series[-1]:.6f}")
+    for metric in sorted({m for m, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (m, labels), value in counters.items():
+            if m == metric:
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for metric in sorted({m for m, _ in gauges}):
+        lines.append(f"# TYPE {metric} gauge")
+        for (m, labels), value in gauges.items():
+            if m == metric:
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@st.cache_resource
+def start_metrics_server():
+    # One scrape endpoint per process, only when TELEMETRY_PORT is set
+    if not METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer(("127.0.0.1", int(METRICS_PORT)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Sidebar panel
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def sidebar_panel():
+    spans = st.session_state.get("telemetry_spans", [])
+    with st.sidebar.expander("📈 Session metrics"):
+        if not spans:
+            st.caption("No calls measured yet.")
+            return
+        rows = {}
+        for s in spans:
+            rows.setdefault((s["page"], s["kind"]), []).append(s)
+        table = []
+        for (page, kind), group in rows.items():
+            durations = [s["duration"] for s in group]
+            ttfts = [s["ttft"] for s in group if s["ttft"] is not None]
+            rates = [s["tokens_per_s"] for s in group if s.get("tokens_per_s")]
+            queued = [s["queued"] for s in group if s.get("queued") is not None]
+            table.append({
+                "page": page,
+                "kind": kind,
+                "calls": len(group),
+                "p50 s": _percentile(durations, 0.5),
+                "p95 s": _percentile(durations, 0.95),
+                "ttfb s": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+                "queue s": round(sum(queued) / len(queued), 3) if queued else None,
+                "tok/s": round(sum(rates) / len(rates), 1) if rates else None,
+                "tokens": sum((s["input_tokens"] or 0) + (s["output_tokens"] or 0) for s in group),
+                "cost $": round(sum(s["cost"] for s in group), 5),
+            })
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        saved = sum(s.get("saved", 0.0) for s in spans)
+        st.caption(f"Estimated session cost: ${sum(s['cost'] for s in spans):.4f}"
+                   + (f" (${saved:.4f} saved by cached and shared responses)" if saved else ""))
@@ -0,0 +1,131 @@
+"""Import-cost measurement and background warm-up for the Labs.
+
+The pages defer their heavy imports (chromadb, PyPDF2, LangChain, PIL) until
+they are needed, so the first page paints without paying for the others.
+start() then loads those modules in a daemon thread after the first page has
+rendered, so later page visits find them already imported.
+
+Set APP_WARMUP to choose what is warmed:
+
+- imports (default): import the heavy modules of every page
+- all: also create the API clients and build the shared Lab 4 index
+- off: warm nothing
+
+Run ``python warmup.py`` to print the import cost of each page, measured in a
+fresh interpreter per page.
+"""
+
+import importlib
+import os
+import subprocess
+import sys
+import threading
+
+import streamlit as st
+
+import llm_gateway
+import rag_index
+import telemetry
+
+WARMUP_MODE = os.environ.get("APP_WARMUP", "imports").lower()
+
+# Modules each page needs beyond streamlit itself, roughly heaviest first
+PAGE_IMPORTS = {
+    "Lab1": ["openai"],
+    "Lab2": ["openai", "PyPDF2"],
+    "Lab3": ["openai"],
+    "Lab4": ["chromadb", "PyPDF2", "openai"],
+    "Lab5": ["openai", llm_gateway.httpx.__name__],
+    "Lab6a": ["openai", "pydantic"],
+    "Lab6b": ["langchain_openai", "langchain_core"],
+    "Lab8": ["openai", "PIL.Image"],
+    "Lab9": ["anthropic", "openai", "numpy"],
+}
+
+
+def import_module(name):
+    if name == "chromadb":
+        return rag_index.import_chromadb()  # needs the sqlite3 swap first
+    return importlib.import_module(name)
+
+
+def warm_imports():
+    seen = set()
+    for modules in PAGE_IMPORTS.values():
+        for name in modules:
+            if name in seen or name in sys.modules:
+                continue
+            seen.add(name)
+            try:
+                with telemetry.span("import", name):
+                    import_module(name)
+            except Exception:
+                pass  # the page reports missing packages when it is opened
+
+
+def warm_resources():
+    openai_key = st.secrets.get("OPENAI_API_KEY")
+    anthropic_key = st.secrets.get("ANTHROPIC_API_KEY")
+    if anthropic_key:
+        llm_gateway.anthropic_client(anthropic_key)
+    if openai_key:
+        client = llm_gateway.openai_client(openai_key)
+        with telemetry.span("warmup", "rag_index.get_index"):
+            rag_index.get_index(client)
+
+
+def run(mode):
+    if mode in ("imports", "all"):
+        warm_imports()
+    if mode == "all":
+        try:
+            warm_resources()
+        except Exception:
+            pass  # Lab 4 retries the build and shows the error on its own
+
+
+@st.cache_resource
+def start():
+    # One warm-up thread per process, started after the first page has run
+    if WARMUP_MODE == "off":
+        return None
+    thread = threading.Thread(target=run, args=(WARMUP_MODE,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# Import-cost measurement
+
+MEASURE_SNIPPET = """
+import sys, time
+sys.path.insert(0, {root!r})
+import streamlit
+import warmup
+start = time.perf_counter()
+for name in {modules!r}:
+    warmup.import_module(name)
+print(time.perf_counter() - start)
+"""
+
+
+def measure_page(modules, root):
+    # Seconds to import a page's modules in a fresh interpreter where streamlit
+    # (always loaded by the app) is already imported
+    code = MEASURE_SNIPPET.format(root=root, modules=modules)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+def main():
+    root = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'page':<8} {'import s':>9}  modules")
+    for page, modules in PAGE_IMPORTS.items():
+        seconds, error = measure_page(modules, root)
+        cost = f"{seconds:9.3f}" if seconds is not None else f"{'failed':>9}"
+        print(f"{page:<8} {cost}  {', '.join(modules)}" + (f"  ({error})" if error else ""))
+
+
+if __name__ == "__main__":
+    main()